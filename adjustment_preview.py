@@ -0,0 +1,290 @@
+# adjustment_preview.py
+
+import traceback
+
+import cv2
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from debug_types import DebugLevel
+
+
+class AdjustmentJobSignals(QObject):
+    finished = pyqtSignal(int, object, str)  # generation, result, mode
+    failed = pyqtSignal(int, str)
+
+
+class AdjustmentJob(QRunnable):
+    """Applies a snapshot of the adjustments to an image on a worker thread.
+
+    mode is 'preview' (image is a proxy), 'full' or 'regions'. In 'regions'
+    mode only the given (x, y, width, height) rects are rendered and the result
+    is a list of (x, y, array) patches.
+    """
+
+    def __init__(self, generation, adjustments, image, mode, is_stale, regions=None):
+        super().__init__()
+        self.generation = generation
+        self.adjustments = adjustments
+        self.image = image
+        self.mode = mode
+        self.regions = regions
+        self.is_stale = is_stale  # Callable checked before doing any work
+        self.signals = AdjustmentJobSignals()
+
+    def run(self):
+        if self.is_stale(self.generation):
+            self.signals.finished.emit(self.generation, None, self.mode)
+            return
+        try:
+            # Strips stop early once a newer generation supersedes this job
+            cancelled = lambda: self.is_stale(self.generation)
+            if self.mode == 'regions':
+                result = []
+                for x, y, width, height in self.regions:
+                    patch = self.adjustments.apply_region(self.image, x, y, width, height, cancelled=cancelled)
+                    if patch is None:
+                        result = None
+                        break
+                    result.append((x, y, patch))
+            else:
+                result = self.adjustments.apply(self.image, cancelled=cancelled)
+            self.signals.finished.emit(self.generation, result, self.mode)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, f"{e}\n{traceback.format_exc()}")
+
+
+class AdjustmentPreview(QObject):
+    """Renders live adjustment previews on a downscaled proxy of the source image.
+
+    While a slider is moving, adjustments run on a cached proxy sized to the
+    current zoom level. The full-resolution result is computed once the slider
+    is released, after IDLE_TIMEOUT_MS without changes, or whenever another
+    operation needs the real pixels (see commit()).
+
+    When zoomed in far enough that the visible part of the image (plus
+    ROI_MARGIN_PX screen pixels around it) is below ROI_MAX_FRACTION of the
+    image, only the ROI_TILE tiles covering it are rendered, at full
+    resolution. Tiles scrolled into view are filled in as the viewport moves,
+    and the whole image is rendered only on commit().
+
+    Rendering happens on a single worker thread. Every parameter change bumps
+    the generation; only the newest job is kept waiting while another runs, and
+    results from older generations are dropped instead of being shown.
+    """
+    IDLE_TIMEOUT_MS = 300
+    ROI_TILE = 256
+    ROI_MARGIN_PX = 256
+    ROI_MAX_FRACTION = 0.5
+
+    def __init__(self, main_window):
+        super().__init__(main_window)
+        self.mw = main_window
+        self.pending = False  # True while view.image does not reflect the current adjustments
+        self.generation = 0
+
+        self._proxy = None
+        self._proxy_source = None
+        self._proxy_level = None
+
+        self.roi_active = False  # True while the display shows full-resolution tiles of a pending render
+        self._roi_done = set()  # Origins of the tiles already painted for the current generation
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self._active = None  # Job currently on the worker
+        self._queued = None  # Newest job waiting for the worker
+        self._full_generation = None  # Generation of the last full-resolution job submitted
+
+        self.idle_timer = QTimer(self)
+        self.idle_timer.setSingleShot(True)
+        self.idle_timer.setInterval(self.IDLE_TIMEOUT_MS)
+        self.idle_timer.timeout.connect(self.render_full)
+
+    def proxy_level(self):
+        """Returns k so the proxy is the source downscaled by 2**k for the current zoom."""
+        level = 0
+        zoom = self.mw.view.zoom_factor
+        while zoom * (2 ** (level + 1)) <= 1.0:
+            level += 1
+        return level
+
+    def get_proxy(self, level):
+        """Returns the source image downscaled by 2**level, cached until the source changes."""
+        source = self.mw.view.original_image
+        if self._proxy is None or self._proxy_source is not source or self._proxy_level != level:
+            height, width = source.shape[:2]
+            size = (max(1, width >> level), max(1, height >> level))
+            self._proxy = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+            self._proxy_source = source
+            self._proxy_level = level
+            self.mw.show_debug_info(f"Adjustment proxy rebuilt: {size[0]}x{size[1]} (1/{2 ** level})",
+                                    DebugLevel.DEBUG)
+        return self._proxy
+
+    def roi_tiles(self):
+        """Returns the tile rects covering the visible region plus margin, or None when ROI mode does not pay off."""
+        view = self.mw.view
+        if view.original_image is None or self.proxy_level() != 0:
+            return None
+        rect = view.visible_image_rect(self.ROI_MARGIN_PX / view.zoom_factor)
+        if rect is None:
+            return None
+        x, y, width, height = rect
+        image_height, image_width = view.original_image.shape[:2]
+        if width * height > self.ROI_MAX_FRACTION * image_width * image_height:
+            return None
+        size = self.ROI_TILE
+        return [(tile_x, tile_y, min(size, image_width - tile_x), min(size, image_height - tile_y))
+                for tile_y in range(y - y % size, y + height, size)
+                for tile_x in range(x - x % size, x + width, size)]
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def update(self):
+        """Previews the current adjustments, deferring the full-resolution render."""
+        view = self.mw.view
+        if view.original_image is None:
+            return
+        if self.mw.adjustments.is_neutral():
+            self._show_source()
+            return
+        self.generation += 1
+        self.pending = True
+        tiles = self.roi_tiles()
+        if tiles is not None:
+            self._render_tiles(tiles, restart=True)
+            return
+        self.roi_active = False
+        level = self.proxy_level()
+        if level == 0:
+            # Zoomed to 100% or closer: a proxy would not be any smaller
+            self._submit(view.original_image, 'full')
+            return
+        self._submit(self.get_proxy(level), 'preview')
+        self.idle_timer.start()
+
+    def update_viewport(self):
+        """Fills in tiles scrolled into view, or falls back to a regular preview when ROI mode stops paying off."""
+        if not self.pending or not self.roi_active:
+            return
+        tiles = self.roi_tiles()
+        if tiles is None:
+            self.update()
+            return
+        self._render_tiles(tiles)
+
+    def render_full(self):
+        """Queues the full-resolution render of the pending adjustments.
+
+        In ROI mode the visible tiles are already at full resolution, so the
+        rest of the image is left for commit().
+        """
+        self.idle_timer.stop()
+        if not self.pending or self.roi_active or self.mw.view.original_image is None:
+            return
+        if self.mw.adjustments.is_neutral():
+            self._show_source()
+            return
+        if self._full_generation == self.generation:
+            return  # Already on its way
+        self.generation += 1
+        self._submit(self.mw.view.original_image, 'full')
+
+    def commit(self):
+        """Renders the pending adjustments at full resolution before returning.
+
+        Used before anything reads or edits view.image. Jobs still in flight
+        belong to an older generation and their results will be dropped.
+        """
+        self.idle_timer.stop()
+        if not self.pending:
+            return
+        self.generation += 1
+        self._queued = None
+        view = self.mw.view
+        if view.original_image is None:
+            self.pending = False
+            self.roi_active = False
+            return
+        result = self.mw.adjustments.snapshot().apply(view.original_image)
+        self._show_result(self.generation, result, 'full')
+
+    def clear(self):
+        """Drops the cached proxy and any pending work for the previous source image."""
+        self.idle_timer.stop()
+        self.generation += 1
+        self.pending = False
+        self.roi_active = False
+        self._queued = None
+        self._proxy = None
+        self._proxy_source = None
+        self._proxy_level = None
+
+    def _show_source(self):
+        """Shows the source image as is, without rendering, when all adjustments are neutral (e.g. reset_sliders())."""
+        self.idle_timer.stop()
+        self.generation += 1  # Results still on their way are for older settings
+        self._queued = None
+        self._show_result(self.generation, self.mw.view.original_image, 'full')
+
+    def _render_tiles(self, tiles, restart=False):
+        view = self.mw.view
+        if restart or not self.roi_active:
+            if not self.roi_active and view.pixmap_item.has_preview():
+                view.update_view()  # Patches are painted at full resolution
+            self.roi_active = True
+            self._roi_done = set()
+        missing = [tile for tile in tiles if tile[:2] not in self._roi_done]
+        if missing:
+            self._submit(view.original_image, 'regions', missing)
+
+    def _submit(self, image, mode, regions=None):
+        job = AdjustmentJob(self.generation, self.mw.adjustments.snapshot(), image, mode, self.is_stale, regions)
+        job.signals.finished.connect(self._on_job_finished)
+        job.signals.failed.connect(self._on_job_failed)
+        if mode == 'full':
+            self._full_generation = self.generation
+        if self._active is not None:
+            # Latest wins: replace whatever was waiting
+            self._queued = job
+        else:
+            self._active = job
+            self.pool.start(job)
+
+    def _start_queued(self):
+        self._active = None
+        if self._queued is not None:
+            self._active, self._queued = self._queued, None
+            self.pool.start(self._active)
+
+    def _on_job_finished(self, generation, result, mode):
+        self._start_queued()
+        self._show_result(generation, result, mode)
+
+    def _on_job_failed(self, generation, message):
+        self._start_queued()
+        self.mw.show_debug_info(f"Error applying adjustments: {message}", DebugLevel.ERROR)
+
+    def _show_result(self, generation, result, mode):
+        if result is None or self.is_stale(generation) or (mode == 'regions' and not self.roi_active):
+            self.mw.show_debug_info(f"Dropped stale adjustment result (generation {generation})", DebugLevel.DEBUG)
+            return
+        view = self.mw.view
+        if mode == 'full':
+            # A preview or ROI tiles may still be on screen even if the image itself stays
+            display_stale = self.roi_active or (view.pixmap_item is not None and view.pixmap_item.has_preview())
+            self.pending = False
+            self.roi_active = False
+            if result is not view.image:
+                view.image = result
+                view.mark_dirty()
+                view.update_view()
+            elif display_stale:
+                view.update_view()
+            self.mw.show_debug_info("Adjustments rendered at full resolution", DebugLevel.DEBUG)
+        elif mode == 'regions':
+            view.show_preview_regions(result)
+            self._roi_done.update((x, y) for x, y, _ in result)
+            self.mw.show_debug_info(f"Adjustments rendered for {len(result)} visible tiles", DebugLevel.DEBUG)
+        else:
+            view.show_preview(result)
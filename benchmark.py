@@ -0,0 +1,314 @@
+# benchmark.py
+"""Headless benchmarks for ImageOperations and ImageAdjustments.
+
+Times every ImageOperations static method, including open_image_mapped and
+encoding with the encode_params presets, every ImageAdjustments.adjust_*
+method and ImageAdjustments.apply on synthetic images, reports how much faster
+the tiled apply runs on all cores than on one thread, and writes the results
+as JSON, by default to benchmarks/benchmark_results.json, which git ignores.
+No display or Qt is needed.
+
+    python benchmark.py --sizes 0.5 2 12 --repeat 5
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from image_adjustments import ImageAdjustments
+from image_operations import ImageOperations
+
+DEFAULT_SIZES = [0.5, 2, 12, 24, 50, 100]  # Megapixels
+DEFAULT_REPEAT = 7
+DEFAULT_WARMUP = 1
+DEFAULT_OUTPUT = os.path.join('benchmarks', 'benchmark_results.json')
+
+# Slider values used for the adjustment benchmarks; every stage is active
+ADJUSTMENT_PARAMS = {
+    'brightness': 30,
+    'contrast': 20,
+    'saturation': 25,
+    'hue': 10,
+    'sharpness': 0.5,
+    'gamma': 1.4,
+}
+
+
+def make_image(megapixels, color, seed=0):
+    """Returns a deterministic 4:3 BGR or grayscale uint8 image of about the given size."""
+    width = max(1, round(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = max(1, round(width * 3 / 4))
+    rng = np.random.default_rng(seed)
+    # A gradient with noise on top: compresses like a photo, not like flat colour or pure noise
+    gradient = np.add.outer(np.linspace(0, 160, height, dtype=np.float32),
+                            np.linspace(0, 60, width, dtype=np.float32))
+    if color == 'bgr':
+        gradient = np.dstack([gradient, gradient[::-1], gradient[:, ::-1]])
+    noise = rng.integers(0, 36, gradient.shape, dtype=np.uint8)
+    return cv2.add(gradient.astype(np.uint8), noise)
+
+
+def make_adjustments(tiled=None, threads=None, **params):
+    """Returns ImageAdjustments with caching disabled so every run does the full work.
+
+    tiled=True runs apply through the tiled executor at every size and
+    tiled=False never does; None keeps the min_tiled_pixels threshold. threads
+    limits the tiled executor's thread pool; None uses every core.
+    """
+    adjustments = ImageAdjustments(cache_budget_bytes=0, num_threads=threads)
+    for name, value in params.items():
+        setattr(adjustments, name, value)
+    if tiled is not None:
+        adjustments.min_tiled_pixels = 0 if tiled else math.inf
+    return adjustments
+
+
+def operation_cases(workdir):
+    """Returns (group, name, colors, function, setup) for every ImageOperations static method.
+
+    setup, if given, turns the synthetic image into the argument for function.
+    """
+    ops = ImageOperations
+
+    def open_case(extension):
+        def setup(image):
+            path = os.path.join(workdir, f"open_{image.ndim}{extension}")
+            cv2.imwrite(path, image)
+            return path
+        return setup
+
+    def open_mapped_case(extension):
+        # The header size is read once here, as ImageLoader does before it opens the file
+        def setup(image):
+            return open_case(extension)(image), image.shape[1], image.shape[0]
+        return setup
+
+    def open_mapped(argument):
+        path, width, height = argument
+        return ops.open_image_mapped(path, width, height, directory=workdir)[0]
+
+    def encode(extension, **options):
+        params = ops.encode_params(extension, **options)
+        return lambda image: cv2.imencode(extension, image, params)[1]
+
+    cases = [
+        ('open_image[png]', ('bgr', 'gray'), lambda path: ops.open_image(path), open_case('.png')),
+        ('open_image[jpg]', ('bgr', 'gray'), lambda path: ops.open_image(path), open_case('.jpg')),
+        ('open_image_mapped[png]', ('bgr', 'gray'), open_mapped, open_mapped_case('.png')),
+        ('open_image_mapped[jpg]', ('bgr', 'gray'), open_mapped, open_mapped_case('.jpg')),
+        ('save_image[png]', ('bgr', 'gray'),
+         lambda image: ops.save_image(os.path.join(workdir, 'save.png'), image), None),
+        ('save_image[jpg]', ('bgr', 'gray'),
+         lambda image: ops.save_image(os.path.join(workdir, 'save.jpg'), image), None),
+        # Encoding in memory with each encode_params preset, without the disk write
+        ('encode_params[png]', ('bgr', 'gray'), encode('.png'), None),
+        ('encode_params[png-compression-9]', ('bgr', 'gray'), encode('.png', png_compression=9), None),
+        ('encode_params[jpg]', ('bgr', 'gray'), encode('.jpg'), None),
+        ('encode_params[jpg-progressive-optimize]', ('bgr', 'gray'),
+         encode('.jpg', jpeg_progressive=True, jpeg_optimize=True), None),
+        ('create_new_image', ('bgr',),
+         lambda image: ops.create_new_image(image.shape[1], image.shape[0]), None),
+        ('flip[Horizontal]', ('bgr', 'gray'), lambda image: ops.flip(image, 'Horizontal'), None),
+        ('flip[Vertical]', ('bgr', 'gray'), lambda image: ops.flip(image, 'Vertical'), None),
+        ('rotate[cw]', ('bgr', 'gray'), lambda image: ops.rotate(image, 'cw'), None),
+        ('rotate[ccw]', ('bgr', 'gray'), lambda image: ops.rotate(image, 'ccw'), None),
+        ('convert_to_gray', ('bgr',), ops.convert_to_gray, None),
+        ('convert_to_rgb', ('bgr',), ops.convert_to_rgb, None),
+        ('convert_to_hsv', ('bgr',), ops.convert_to_hsv, None),
+        ('convert_to_sepia', ('bgr',), ops.convert_to_sepia, None),
+        ('crop_image', ('bgr', 'gray'),
+         # Cropping returns a view; copy it like every caller that keeps the result does
+         lambda image: ops.crop_image(image, image.shape[1] // 4, image.shape[0] // 4,
+                                      image.shape[1] // 2, image.shape[0] // 2).copy(), None),
+        ('resize_image[half]', ('bgr', 'gray'),
+         lambda image: ops.resize_image(image, image.shape[1] // 2, image.shape[0] // 2), None),
+        ('apply_gaussian_blur', ('bgr', 'gray'), ops.apply_gaussian_blur, None),
+        ('apply_median_blur', ('bgr', 'gray'), ops.apply_median_blur, None),
+        ('detect_edges', ('bgr', 'gray'), ops.detect_edges, None),
+        ('equalize_histogram', ('bgr',), ops.equalize_histogram, None),
+    ]
+    return [('ImageOperations', name, colors, function, setup) for name, colors, function, setup in cases]
+
+
+def adjustment_cases():
+    """Returns (group, name, colors, function, setup) for every adjust_* method and for apply."""
+    params = ADJUSTMENT_PARAMS
+    grayscale_safe = {name: value for name, value in params.items() if name not in ('saturation', 'hue')}
+    cases = [
+        ('adjust_brightness', ('bgr', 'gray'), make_adjustments(brightness=params['brightness']).adjust_brightness),
+        ('adjust_contrast', ('bgr', 'gray'), make_adjustments(contrast=params['contrast']).adjust_contrast),
+        ('adjust_saturation', ('bgr',), make_adjustments(saturation=params['saturation']).adjust_saturation),
+        ('adjust_hue', ('bgr',), make_adjustments(hue=params['hue']).adjust_hue),
+        ('adjust_hsv', ('bgr',),
+         make_adjustments(saturation=params['saturation'], hue=params['hue']).adjust_hsv),
+        ('adjust_sharpness', ('bgr', 'gray'), make_adjustments(sharpness=params['sharpness']).adjust_sharpness),
+        ('adjust_gamma', ('bgr', 'gray'), make_adjustments(gamma=params['gamma']).adjust_gamma),
+        # Tiled and serial are forced at every size; below min_tiled_pixels apply itself would run serially
+        ('apply[tiled]', ('bgr',), make_adjustments(tiled=True, **params).apply),
+        ('apply[tiled-1-thread]', ('bgr',), make_adjustments(tiled=True, threads=1, **params).apply),
+        ('apply[serial]', ('bgr',), make_adjustments(tiled=False, **params).apply),
+        ('apply[tiled]', ('gray',), make_adjustments(tiled=True, **grayscale_safe).apply),
+        ('apply[tiled-1-thread]', ('gray',), make_adjustments(tiled=True, threads=1, **grayscale_safe).apply),
+        ('apply[serial]', ('gray',), make_adjustments(tiled=False, **grayscale_safe).apply),
+        ('apply[point-only]', ('bgr', 'gray'),
+         make_adjustments(brightness=params['brightness'], contrast=params['contrast'],
+                          gamma=params['gamma']).apply),
+    ]
+    return [('ImageAdjustments', name, colors, function, None) for name, colors, function in cases]
+
+
+def measure(function, argument, repeat, warmup):
+    """Returns per-run wall times in seconds and the traced peak allocation in bytes.
+
+    The peak is taken from a separate untimed run so tracemalloc does not skew
+    the timings. It covers NumPy buffers, including arrays returned by OpenCV,
+    but not OpenCV's internal scratch memory.
+    """
+    for _ in range(warmup):
+        function(argument)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        function(argument)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def summarize(group, name, color, image, times, peak):
+    times_ms = np.array(times) * 1000
+    megapixels = image.shape[0] * image.shape[1] / 1e6
+    p50 = float(np.percentile(times_ms, 50))
+    return {
+        'group': group,
+        'name': name,
+        'color': color,
+        'width': image.shape[1],
+        'height': image.shape[0],
+        'megapixels': round(megapixels, 3),
+        'repeat': len(times),
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(float(np.percentile(times_ms, 95)), 3),
+        'min_ms': round(float(times_ms.min()), 3),
+        'mean_ms': round(float(times_ms.mean()), 3),
+        'throughput_mps': round(megapixels / (p50 / 1000), 2) if p50 > 0 else None,
+        'peak_alloc_bytes': int(peak),
+    }
+
+
+def run(sizes, colors, repeat, warmup, name_filter=None, log=print):
+    """Runs every matching case and returns the list of result records."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='pyqtshop-bench-') as workdir:
+        cases = operation_cases(workdir) + adjustment_cases()
+        if name_filter:
+            cases = [case for case in cases if name_filter in f"{case[0]}.{case[1]}"]
+        for megapixels in sizes:
+            for color in colors:
+                image = make_image(megapixels, color)
+                for group, name, case_colors, function, setup in cases:
+                    if color not in case_colors:
+                        continue
+                    argument = setup(image) if setup is not None else image
+                    try:
+                        times, peak = measure(function, argument, repeat, warmup)
+                    except (cv2.error, MemoryError) as e:
+                        log(f"{group}.{name} [{color}, {megapixels} MP] failed: {e}")
+                        continue
+                    record = summarize(group, name, color, image, times, peak)
+                    results.append(record)
+                    log(f"{group + '.' + name:<56} {color:<4} {record['megapixels']:>8.2f} MP "
+                        f"p50 {record['p50_ms']:>10.2f} ms  p95 {record['p95_ms']:>10.2f} ms  "
+                        f"{record['throughput_mps'] or 0:>9.1f} MP/s  "
+                        f"peak {record['peak_alloc_bytes'] / 2 ** 20:>8.1f} MiB")
+                del image
+    return results
+
+
+def speedups(results, log=print):
+    """Returns the multi-core speedup of apply[tiled] per color and size.
+
+    vs_1_thread is the p50 of the same tiled chain on one thread divided by
+    the p50 on all cores; vs_serial compares with the untiled chain.
+    """
+    p50 = {(record['name'], record['color'], record['megapixels']): record['p50_ms'] for record in results
+           if record['group'] == 'ImageAdjustments'}
+    records = []
+    for (name, color, megapixels), tiled_ms in p50.items():
+        if name != 'apply[tiled]' or not tiled_ms:
+            continue
+        record = {'color': color, 'megapixels': megapixels, 'threads': os.cpu_count()}
+        for label, other in (('vs_1_thread', 'apply[tiled-1-thread]'), ('vs_serial', 'apply[serial]')):
+            other_ms = p50.get((other, color, megapixels))
+            record[label] = round(other_ms / tiled_ms, 2) if other_ms else None
+        records.append(record)
+        log(f"apply[tiled] speedup {color:<4} {megapixels:>8.2f} MP, {record['threads']}-thread pool: "
+            f"{record['vs_1_thread'] or 0:.2f}x vs 1 thread, {record['vs_serial'] or 0:.2f}x vs serial")
+    return records
+
+
+def environment():
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'opencv_threads': cv2.getNumThreads(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ImageOperations and ImageAdjustments.")
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help="image sizes in megapixels (default: %(default)s)")
+    parser.add_argument('--colors', nargs='+', choices=('bgr', 'gray'), default=['bgr', 'gray'],
+                        help="image layouts to test (default: both)")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timed runs per case")
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help="untimed runs per case")
+    parser.add_argument('--filter', dest='name_filter',
+                        help="only run cases whose 'Group.name' contains this text")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="JSON file to write (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.colors, args.repeat, args.warmup, args.name_filter)
+    report = {
+        'environment': environment(),
+        'settings': {
+            'sizes_mp': args.sizes,
+            'colors': args.colors,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'filter': args.name_filter,
+            'adjustment_params': ADJUSTMENT_PARAMS,
+        },
+        'results': results,
+        'speedups': speedups(results),
+    }
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"{len(results)} results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
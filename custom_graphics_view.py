@@ -1,13 +1,20 @@
 # custom_graphics_view.py
+import sys
 import traceback
+from contextlib import contextmanager
 
 import numpy as np
 from PyQt5.QtWidgets import QGraphicsView, QGraphicsScene, QRubberBand, QInputDialog, \
     QGraphicsEllipseItem, QGraphicsRectItem, QGraphicsLineItem, QGraphicsDropShadowEffect, QApplication, QMessageBox
 from PyQt5.QtGui import QImage, QCursor, QPixmap, QPainter, QPainterPath, QColor, QPolygonF, QPen, QFont, QBrush
-from PyQt5.QtCore import Qt, QRect, QRectF, pyqtSignal, QPointF, QPoint, QLineF, QSize, QByteArray, QBuffer
+from PyQt5.QtCore import Qt, QRect, QRectF, pyqtSignal, QPointF, QPoint, QSize
 from draggable_items import (DraggableTextItem, DraggableCircleItem, DraggableRectangleItem,
                              DraggableLineItem, DraggablePathItem, DraggablePixmapItem, DraggablePolygonItem)
+from image_item import ImageItem
+from stroke_layer import StrokeLayer
+from stroke_input import StrokeInput
+from out_of_core import scratch_copy
+from history_store import HistorySpill, HistoryWorker, SpilledArray
 from line_profiler import profile
 from debug_types import DebugLevel
 
@@ -20,6 +27,12 @@ class CustomGraphicsView(QGraphicsView):
     debugInfo = pyqtSignal(str, DebugLevel)
     undoStateChanged = pyqtSignal(bool)  # Signal emitted when undo state changes
     redoStateChanged = pyqtSignal(bool)  # Signal emitted when redo state changes
+    imageCommitRequested = pyqtSignal()  # Emitted before pixels are edited so pending previews get rendered
+    viewportChanged = pyqtSignal()  # Emitted when the visible part of the scene moves or is resized
+    historyUsageChanged = pyqtSignal(int, int, int)  # History entries, bytes in memory, bytes spilled to disk
+
+    WHOLE_IMAGE = (0, 0, sys.maxsize, sys.maxsize)  # Dirty rect that covers any image
+    JOURNALED_ITEM_TYPES = (DraggableCircleItem, DraggableRectangleItem, DraggableTextItem, DraggableLineItem)
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -32,14 +45,35 @@ class CustomGraphicsView(QGraphicsView):
         # History list and position for undo/redo
         self.history = []
         self.current_history_index = -1
-        self.max_history_size = 20  # Maximum history size
+        # Entry pixels beyond the memory budget are compressed to disk, the entries farthest from
+        # the current one first; beyond the disk budget the oldest entries are dropped
+        self.history_memory_budget = 512 * 2 ** 20
+        self.history_disk_budget = 4 * 2 ** 30
+        self.history_spill = HistorySpill()
+        self.history_image = None  # The image as of the current history entry, which entries are deltas against
+        # Entry pixels are captured and spilled on a worker thread; _capture_state is the entry whose
+        # capture last updated history_image, which stays off limits while that is pending
+        self.history_worker = HistoryWorker(self)
+        self.history_worker.jobFinished.connect(self._on_history_job_finished)
+        self._capture_state = None
+        # Entries journal item changes instead of snapshotting every item: item_states holds each
+        # item's data as of the current entry, changed_items the ids noted since (note_item_change)
+        self.items_by_id = {}
+        self.item_states = {}
+        self.changed_items = set()
+        self._next_item_id = 0
+        # save_state calls inside a history transaction are recorded as one entry when it commits
+        self._transaction_depth = 0
+        self._transaction_changes = []  # The command passed to each deferred save_state, None for plain ones
 
         self.previous_cursor = None
         self.previous_tool = None
 
         self.image = None
+        self.dirty_rect = None  # (x, y, width, height) changed since the last save_state, None if unchanged
         self.original_image = None
         self.initial_image = None
+        self.out_of_core = False  # Whether image copies live in scratch files instead of RAM
         self.rendered_image = None
         self.pixmap = None
         self.pixmap_item = None
@@ -79,8 +113,11 @@ class CustomGraphicsView(QGraphicsView):
         self.pen = QPen(Qt.black, self.brush_size, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
         self.emit_debug(f"Pen color: {self.pen.color().name()}, width: {self.pen.width()}", DebugLevel.INFO)
         self.brush_opacity = 1.0
+        self.brush_hardness = 1.0  # 1 is a hard edge; lower values fade out over more of the radius
         self.brush_preview_item = None
         self.brush_last_point = None
+        self.stroke_layer = None  # Collects the brush stroke in progress, see StrokeLayer
+        self.stroke_input = StrokeInput(self)  # Coalesces brush moves per frame before drawing them
 
         self.alt_pressed = False
         self.control_pressed = False
@@ -103,38 +140,169 @@ class CustomGraphicsView(QGraphicsView):
         self.setTransformationAnchor(QGraphicsView.NoAnchor)
         self.setResizeAnchor(QGraphicsView.NoAnchor)
 
-    def set_image(self, image, is_new_image=False):
-        self.image = image
-        self.original_image = image.copy()
+    def set_image(self, image, is_new_image=False, out_of_core=False):
+        """Makes image the current one; out_of_core only applies to a new image and sticks until the next."""
+        if is_new_image:
+            self.out_of_core = out_of_core
+        # One read-only buffer serves as the live image, the adjustment source and the history
+        # reference; whoever writes to it first takes a private copy (see writable_image)
+        self.image = self.share_image(self._to_storage(image))
+        self.mark_dirty()
+        self.original_image = self.image
         if is_new_image:
-            self.initial_image = image.copy()
+            self.initial_image = self.image
             # Reset history when a new image is loaded
-            self.history = []
-            self.current_history_index = -1
+            self._clear_history()
             self.save_state() # Save the initial state
         else:
             # For filters/rotations, don't reset history, just save state
             self.save_state()
             
         self.update_view()
+        self.imageChanged.emit()
         self.emit_debug(f"Image set: shape={self.image.shape}, is_new_image={is_new_image}", DebugLevel.INFO)
 
-    def update_view(self):
-        if self.image is not None:
-            height, width, channel = self.image.shape
-            bytes_per_line = 3 * width
-            q_img = QImage(self.image.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
+    def _to_storage(self, image):
+        """Returns image, moved to a scratch file if it is an in-RAM result (e.g. of a filter) while out of core."""
+        if self.out_of_core and not isinstance(image, np.memmap):
+            return scratch_copy(image)
+        return image
 
-            pixmap = QPixmap.fromImage(q_img)
-            if self.pixmap_item is None:
-                self.pixmap_item = self.scene.addPixmap(pixmap)
-            else:
-                self.pixmap_item.setPixmap(pixmap)
+    def apply_reversible(self, forward, inverse):
+        """Replaces the image with forward(image) and records inverse in the history instead of pixels.
+
+        For operations that inverse undoes exactly, such as flips and 90
+        degree rotations. Unsaved edits are saved as their own entry first.
+        """
+        if self.image is None:
+            return
+        if self.dirty_rect is not None:
+            self.save_state()
+        self.image = self.share_image(self._to_storage(forward(self.image)))
+        self.original_image = self.image
+        self.save_state(command=(inverse, forward))
+        self.update_view()
+        self.imageChanged.emit()
+        self.emit_debug(f"Reversible operation applied: shape={self.image.shape}", DebugLevel.INFO)
+
+    def copy_image(self, image):
+        """Returns a copy of image, in a scratch file when the current image is out of core."""
+        return scratch_copy(image) if self.out_of_core else image.copy()
+
+    @staticmethod
+    def share_image(image):
+        """Marks image read-only so it can be shared instead of copied; returns it."""
+        image.flags.writeable = False
+        return image
+
+    def writable_image(self, image):
+        """Returns image if it is private (writable), otherwise a private copy: the copy in copy-on-write."""
+        return image if image.flags.writeable else self.copy_image(image)
+
+    def _covers_image(self, rect):
+        height, width = self.image.shape[:2]
+        return rect == (0, 0, width, height)
+
+    @staticmethod
+    def union_rect(a, b):
+        """Returns the bounding box of two (x, y, width, height) rects, either of which may be None."""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        left, top = min(a[0], b[0]), min(a[1], b[1])
+        right, bottom = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+        return left, top, right - left, bottom - top
+
+    def mark_dirty(self, rect=None):
+        """Records that rect of self.image changed since the last saved state; None means all of it."""
+        self.dirty_rect = self.union_rect(self.dirty_rect, rect if rect is not None else self.WHOLE_IMAGE)
+
+    def update_view(self, rect=None):
+        """Shows self.image; rect=(x, y, width, height) limits the upload and repaint to that region."""
+        if self.image is not None:
+            height, width = self.image.shape[:2]
+            if rect is not None and self.pixmap_item is not None and self.pixmap_item.size() == (width, height):
+                self.pixmap_item.update_region(self.image, *rect)
+                self.emit_debug(f"View updated in {rect}", DebugLevel.INFO)
+                return
+            self._ensure_pixmap_item()
+            self.pixmap_item.set_out_of_core(self.out_of_core)
+            # Converted in place into the item's persistent display buffer
+            self.pixmap_item.set_image(self.image)
 
             self.scene.setSceneRect(0, 0, width, height)
             self.setScene(self.scene)
             self.emit_debug("View updated", DebugLevel.INFO)
 
+    def _ensure_pixmap_item(self):
+        if self.pixmap_item is None:
+            self.pixmap_item = ImageItem()
+            self.pixmap_item.pyramid.debugInfo.connect(self.emit_debug)
+            self.scene.addItem(self.pixmap_item)
+
+    def show_placeholder(self, preview, width, height):
+        """Shows a reduced-resolution decode stretched to width x height while the full image loads.
+
+        The previous image and its history are dropped; there is nothing to
+        edit until set_image() is called with the full image.
+        """
+        self.image = self.original_image = self.initial_image = None
+        self.dirty_rect = None
+        self._clear_history()
+        self._ensure_pixmap_item()
+        self.pixmap_item.set_placeholder(preview, width, height)
+        self.scene.setSceneRect(0, 0, width, height)
+        self.undoStateChanged.emit(False)
+        self.redoStateChanged.emit(False)
+        self.imageChanged.emit()
+        self.emit_debug(f"Placeholder shown: {preview.shape[1]}x{preview.shape[0]} for {width}x{height}",
+                        DebugLevel.INFO)
+
+    def show_preview(self, preview):
+        """Shows a downscaled rendering stretched over the image rect, leaving self.image untouched.
+
+        The next update_view() call swaps the full-resolution image back in.
+        """
+        if self.image is None or self.pixmap_item is None:
+            return
+        self.pixmap_item.set_preview(preview)
+        self.emit_debug(f"Preview shown: {preview.shape[1]}x{preview.shape[0]}", DebugLevel.DEBUG)
+
+    def show_preview_regions(self, patches):
+        """Writes full-resolution (x, y, array) patches over the displayed image, leaving self.image untouched.
+
+        No preview may be showing. The next update_view() call shows self.image again.
+        """
+        if self.image is None or self.pixmap_item is None or not patches:
+            return
+        self.pixmap_item.write_regions(patches)
+        self.emit_debug(f"Preview regions painted: {len(patches)}", DebugLevel.DEBUG)
+
+    def visible_image_rect(self, margin=0):
+        """Returns the visible part of the image grown by margin pixels as integer (x, y, width, height).
+
+        Returns None when no image is shown or it is entirely out of view.
+        """
+        if self.image is None:
+            return None
+        height, width = self.image.shape[:2]
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        rect = rect.adjusted(-margin, -margin, margin, margin).intersected(QRectF(0, 0, width, height))
+        if rect.isEmpty():
+            return None
+        left, top = int(rect.left()), int(rect.top())
+        right, bottom = min(width, int(np.ceil(rect.right()))), min(height, int(np.ceil(rect.bottom())))
+        return left, top, right - left, bottom - top
+
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.viewportChanged.emit()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.viewportChanged.emit()
+
     def set_tool(self, tool):
         self.current_tool = tool
         if tool == 'move':
@@ -185,7 +353,11 @@ class CustomGraphicsView(QGraphicsView):
                 self.setCursor(Qt.ClosedHandCursor)
                 super().mousePressEvent(event)
                 return
-            elif self.alt_pressed and event.button() == Qt.LeftButton:
+            if self.current_tool != 'zoom':
+                # Panning and zooming only move the viewport, everything else may touch pixels
+                self.imageCommitRequested.emit()
+
+            if self.alt_pressed and event.button() == Qt.LeftButton:
                 self.alt_left_pressed = True
 
             elif self.alt_pressed and event.button() == Qt.RightButton:
@@ -284,11 +456,16 @@ class CustomGraphicsView(QGraphicsView):
             self.emit_debug(f"Brush Size: {self.brush_size}", DebugLevel.INFO)
             self.previous_mouse_pos = event.pos()
 
+        if self.current_tool == 'brush':
+            # Mapped, previewed and drawn once per frame, however many moves the device sends
+            self.stroke_input.move(event.pos())
+            if not self.is_drawing:
+                super().mouseMoveEvent(event)
+            return
+
         pos = self.mapToScene(event.pos())
         if self.pixmap_item:
             pos = self.pixmap_item.mapFromScene(pos)
-        if self.current_tool == 'brush':
-            self.update_brush_preview(self.mapToScene(event.pos()))
 
         if self.is_drawing:
             if self.current_tool == 'circle':
@@ -301,12 +478,6 @@ class CustomGraphicsView(QGraphicsView):
                 self.update_path(pos)
             elif self.current_tool == 'polygon':
                 self.update_polygon(pos)
-
-            elif self.current_tool == 'brush':
-                if self.shift_left_pressed:
-                    self.draw_shift_left_line(pos)
-                elif event.buttons() & Qt.LeftButton or Qt.RightButton:
-                    self.draw_line_to(pos)
         elif self.current_tool == 'crop' and self.rubberband and not self.rubberband.isHidden():
             self.update_rubberband(event.pos())
 
@@ -358,10 +529,10 @@ class CustomGraphicsView(QGraphicsView):
                 pos = self.pixmap_item.mapFromScene(pos)
 
             if self.is_drawing:
-                self.is_drawing = False
                 if self.current_tool == 'brush':
-                    self.end_drawing()
-                elif self.current_tool == 'circle':
+                    self.end_drawing()  # Only commits while is_drawing is still set
+                self.is_drawing = False
+                if self.current_tool == 'circle':
                     self.finish_circle(self.start_pos, pos)
                 elif self.current_tool == 'rectangle':
                     self.finish_rectangle(self.start_pos, pos)
@@ -406,6 +577,9 @@ class CustomGraphicsView(QGraphicsView):
                             item.setPos(item.start_pos + delta)
                             self.emit_debug(f"Finished moving item to {item.pos()}", DebugLevel.INFO)
                             delattr(item, 'start_pos')
+                            # Selected items are dragged along with the one under the cursor
+                            for moved in [item] + self.scene.selectedItems():
+                                self.note_item_change(moved)
                             
                             # Save state after moving the item
                             self.save_state()
@@ -447,8 +621,10 @@ class CustomGraphicsView(QGraphicsView):
                                          DraggableLineItem, DraggablePathItem, DraggablePixmapItem,
                                          DraggablePolygonItem)):
                         self.scene.removeItem(item)
+                        self.note_item_change(item)
                         self.emit_debug(f"Deleted item: {item}", DebugLevel.INFO)
             elif self.control_pressed:
+                self.imageCommitRequested.emit()
                 if event.key() == Qt.Key_V and not event.isAutoRepeat():
                     if self.paste_image_from_clipboard():
                         # Save state after successful paste
@@ -578,9 +754,8 @@ class CustomGraphicsView(QGraphicsView):
                  QMessageBox.warning(self, "Crop Error", "Crop resulted in an empty image.")
                  return
 
-            # Update the image and view using set_image
+            # Update the image and view using set_image, which saves the cropped state
             self.set_image(cropped_img) # Updates original_image, pixmap_item, and view
-            self.save_state() # Save the new cropped state
             self.emit_debug("Image cropped successfully", DebugLevel.INFO)
 
         except Exception as e:
@@ -624,12 +799,29 @@ class CustomGraphicsView(QGraphicsView):
             radius = self.brush_size / 2
             self.brush_preview_item.setRect(pos.x() - radius, pos.y() - radius, self.brush_size, self.brush_size)
 
+    def _begin_stroke(self):
+        if self.stroke_layer is None:
+            self.stroke_layer = StrokeLayer()
+            self.scene.addItem(self.stroke_layer)
+        if not self.stroke_layer.active:
+            self.stroke_layer.setZValue(self.pixmap_item.zValue() + 1)  # Under the brush preview
+            # The pen only carries the color; the opacity is its alpha
+            self.stroke_layer.begin(self.pen.color(), self.brush_size, self.brush_hardness, *self.pixmap_item.size())
+
     def start_drawing(self, pos):
         self.is_drawing = True
         self.brush_last_point = pos
+        self._begin_stroke()
+        self.stroke_layer.add_segment(pos, pos)  # A click alone leaves one dab
+        self.stroke_input.begin(pos)
         self.emit_debug(f"Started drawing at {pos}", DebugLevel.INFO)
 
     def draw_shift_left_line(self, end_point):
+        self.draw_line_to(self.constrain_shift_line(end_point))
+
+    def constrain_shift_line(self, end_point):
+        """Returns end_point moved onto the horizontal or vertical through shift_start_point."""
+        end_point = QPointF(end_point)
         dx = end_point.x() - self.shift_start_point.x()
         dy = end_point.y() - self.shift_start_point.y()
 
@@ -643,8 +835,7 @@ class CustomGraphicsView(QGraphicsView):
             end_point.setY(self.shift_start_point.y())
         elif self.shift_direction == 'vertical':
             end_point.setX(self.shift_start_point.x())
-
-        self.draw_line_to(end_point)
+        return end_point
 
     def draw_line_to(self, end_point):
         # start_time = time.time()
@@ -653,9 +844,9 @@ class CustomGraphicsView(QGraphicsView):
         if self.brush_last_point != end_point:  # Only draw if points are different
             # Tho brush_last_point shouldn't be same with end_point, since this only works when mouse moves.
             # This might work on shift press situations.
-            scene_line = QLineF(self.brush_last_point, end_point)
-            line_item = self.scene.addLine(scene_line, self.pen)
-            self.emit_debug(f"Line added to scene: {scene_line.p1()} to {scene_line.p2()}", DebugLevel.INFO)
+            self._begin_stroke()
+            self.stroke_layer.add_segment(self.brush_last_point, end_point)
+            self.emit_debug(f"Segment painted: {self.brush_last_point} to {end_point}", DebugLevel.INFO)
             self.brush_last_point = end_point
             # self.emit_debug(f"Drew line to {end_point}")
         else:
@@ -667,35 +858,32 @@ class CustomGraphicsView(QGraphicsView):
 
     def end_drawing(self):
         if self.is_drawing:
+            self.stroke_input.end()  # Draws the moves still buffered for the next frame
             self.shift_start_point = None
             self.shift_direction = None
             
-            # Çizim öncesi durumu kaydet
-            self.save_state()
-            
-            pixmap = self.pixmap_item.pixmap()
-            painter = QPainter(pixmap)
-            painter.setRenderHint(QPainter.Antialiasing, True)
-
-            for item in self.scene.items():
-                if isinstance(item, QGraphicsLineItem):
-                    line = item.line()
-                    painter.setPen(item.pen())
-                    painter.drawLine(line)
-                    self.scene.removeItem(item)
-
-            painter.end()
-            self.pixmap_item.setPixmap(pixmap)
-            self.scene.update()
-            self.update_image_from_pixmap()
+            # Blends the stroke buffer into the display buffer in one pass, only where the stroke is
+            rect = self.stroke_layer.commit(self.pixmap_item) if self.stroke_layer is not None else None
+            if rect is not None:
+                self.update_image_from_pixmap(rect)
+                # History entries hold the change that led to them, so the stroke is saved once it is in the image
+                self.save_state()
             
             self.emit_debug("Drawing ended and applied to pixmap", DebugLevel.INFO)
 
-    def update_image_from_pixmap(self):
-        if self.pixmap_item is not None:
-            pixmap = self.pixmap_item.pixmap()
-            image = pixmap.toImage()
-            self.image = self.qImage_to_numpy(image)
+    def update_image_from_pixmap(self, rect=None):
+        """Copies displayed pixels back into self.image, only inside rect=(x, y, width, height) if given."""
+        if self.pixmap_item is None:
+            return
+        if rect is None or self.image is None or self.image.ndim != 3 \
+                or self.image.shape[:2] != self.pixmap_item.size()[::-1]:
+            self.image = self.pixmap_item.to_array()
+            self.mark_dirty()
+            return
+        if not self.image.flags.writeable:
+            self.image = self.writable_image(self.image)  # Shared with the history or the adjustment cache
+        self.pixmap_item.read_region(self.image, *rect)
+        self.mark_dirty(rect)
 
     @staticmethod
     def qImage_to_numpy(q_image):
@@ -721,6 +909,7 @@ class CustomGraphicsView(QGraphicsView):
                     text_item.setPos(scene_pos)
                     text_item.setZValue(self.pixmap_item.zValue() + 1)
                     self.scene.addItem(text_item)
+                    self.note_item_change(text_item)
                     self.scene.clearSelection()
                     text_item.setSelected(True)
                     
@@ -795,6 +984,7 @@ class CustomGraphicsView(QGraphicsView):
                 circle.setBrush(QBrush())
             
             self.scene.addItem(circle)
+            self.note_item_change(circle)
             
             # Save the current state after adding the shape
             self.save_state()
@@ -842,6 +1032,7 @@ class CustomGraphicsView(QGraphicsView):
             
             rectangle.setPos(rect.topLeft())
             self.scene.addItem(rectangle)
+            self.note_item_change(rectangle)
             
             # Save the current state after adding the shape
             self.save_state()
@@ -866,6 +1057,7 @@ class CustomGraphicsView(QGraphicsView):
             line.setPen(QPen(self.first_color, self.brush_size, self.pen_style, self.pen_cap, self.pen_join))
             line.setPos(start.x(), start.y())
             self.scene.addItem(line)
+            self.note_item_change(line)
             
             # Save the current state after adding the line
             self.save_state()
@@ -966,6 +1158,7 @@ class CustomGraphicsView(QGraphicsView):
             self.zoom_factor = new_zoom
             self.update_scene_rect()
             self.zoomChanged.emit(self.zoom_factor * 100)
+            self.viewportChanged.emit()
         else:
             # Restoring
             self.scale(1 / factor, 1 / factor)
@@ -1008,11 +1201,12 @@ class CustomGraphicsView(QGraphicsView):
             # self.scale(self.scale_factor, self.scale_factor)  # Fit image to the window
             self.zoom_factor = 1.0
             self.zoomChanged.emit(self.zoom_factor * 100)
+            self.viewportChanged.emit()
             self.emit_debug(f"Zoom reset: zoom_factor={self.zoom_factor}", DebugLevel.INFO)
 
     def reset_image(self):
         if self.original_image is not None:
-            self.set_image(self.original_image.copy())
+            self.set_image(self.original_image)
 
     def get_image(self):
         return self.image
@@ -1020,7 +1214,7 @@ class CustomGraphicsView(QGraphicsView):
     def pick_color(self, pos):
         scene_pos = self.mapToScene(pos)
         if self.pixmap_item:
-            pixel_color = self.pixmap_item.pixmap().toImage().pixelColor(int(scene_pos.x()), int(scene_pos.y()))
+            pixel_color = self.pixmap_item.pixel_color(int(scene_pos.x()), int(scene_pos.y()))
             self.colorPicked.emit(pixel_color)
             self.emit_debug(f"Color picked: RGB({pixel_color.red()}, {pixel_color.green()}, {pixel_color.blue()})", DebugLevel.INFO)
 
@@ -1083,6 +1277,10 @@ class CustomGraphicsView(QGraphicsView):
             preview_color.setAlpha(preview_alpha)
             self.brush_preview_item.setBrush(preview_color)
 
+    def set_brush_hardness(self, hardness):
+        self.brush_hardness = hardness / 100.0
+        self.emit_debug(f"Brush hardness set to: {self.brush_hardness}", DebugLevel.INFO)
+
     def set_brush_size(self, size):
         self.brush_size = size
         self.emit_debug(f"Brush size set to: {size}", DebugLevel.INFO)
@@ -1100,38 +1298,39 @@ class CustomGraphicsView(QGraphicsView):
         for item in self.scene.selectedItems():
             item.setSelected(False)
 
-        scene_rect = self.scene.sceneRect()
-        width = int(scene_rect.width())
-        height = int(scene_rect.height())
-
-        qimage = QImage(width, height, QImage.Format_RGBA8888)
-        qimage.fill(0)  # This one creates transparent background
-
-        painter = QPainter(qimage)
-        self.scene.render(painter, QRectF(qimage.rect()), scene_rect)
-        painter.end()
-
-        # QImage to numpy arr
-        ptr = qimage.bits()
-        ptr.setsize(height * width * 4)
-        arr = np.frombuffer(ptr, np.uint8).reshape((height, width, 4))
-
-        # BGR to RGB
-        arr = arr[:, :, [2, 1, 0, 3]]
+        # Without overlay items the image itself is the result; sharing it keeps it unchanged for the saver
+        rendered_image = self.share_image(self.image)
 
-        # Numpy arr to org image
-        y_end = min(self.image.shape[0], arr.shape[0])
-        x_end = min(self.image.shape[1], arr.shape[1])
+        # Only the area under the other items can change, so only that area is rendered
+        overlay_rect = QRectF()
+        for item in self.scene.items():
+            if item is not self.pixmap_item and item.isVisible():
+                overlay_rect = overlay_rect.united(item.sceneBoundingRect())
+        region = overlay_rect.toAlignedRect().intersected(self.pixmap_item.boundingRect().toAlignedRect())
+
+        if not region.isEmpty():
+            x, y, width, height = region.x(), region.y(), region.width(), region.height()
+            rendered_image = self.copy_image(self.image)
+            qimage = QImage(width, height, QImage.Format_RGBA8888)
+            qimage.fill(0)  # This one creates transparent background
+
+            painter = QPainter(qimage)
+            self.pixmap_item.hide()  # Items are blended over self.image below
+            self.scene.render(painter, QRectF(qimage.rect()), QRectF(region))
+            self.pixmap_item.show()
+            painter.end()
 
-        alpha_s = arr[:y_end, :x_end, 3] / 255.0
-        alpha_l = 1.0 - alpha_s
+            # QImage to numpy arr
+            ptr = qimage.bits()
+            ptr.setsize(qimage.byteCount())
+            arr = np.frombuffer(ptr, np.uint8).reshape((height, qimage.bytesPerLine() // 4, 4))[:, :width]
 
-        rendered_image = self.image.copy()
-        for c in range(0, 3):
-            rendered_image[:y_end, :x_end, c] = (alpha_s * arr[:y_end, :x_end, c] +
-                                                 alpha_l * rendered_image[:y_end, :x_end, c]).astype(np.uint8)
+            # RGB to BGR, blended by alpha
+            alpha_s = arr[:, :, 3:] / 255.0
+            target = rendered_image[y:y + height, x:x + width]
+            target[...] = (alpha_s * arr[:, :, 2::-1] + (1.0 - alpha_s) * target).astype(np.uint8)
 
-        self.rendered_image = rendered_image
+        self.rendered_image = self.share_image(rendered_image)  # Read-only either way, e.g. for the saver
         self.emit_debug("Scene rendered to image", DebugLevel.INFO)
 
     def map_to_image(self, pos):
@@ -1158,128 +1357,52 @@ class CustomGraphicsView(QGraphicsView):
 
     # region Undo/Redo Functions
     
-    def save_state(self):
-        """Saves the current image state to the history"""
+    def save_state(self, command=None):
+        """Saves the current image state to the history.
+
+        command=(inverse, forward) records an exactly reversible operation
+        that was just applied; the entry then keeps the two functions
+        instead of pixels (see apply_reversible).
+        """
         if self.image is None:
             self.emit_debug("save_state called but no image exists", DebugLevel.WARNING)
             return
+        if self._transaction_depth:
+            self._transaction_changes.append(command)
+            self.emit_debug(f"save_state deferred to the open history transaction ({len(self._transaction_changes)})",
+                            DebugLevel.DEBUG)
+            return
         
-        # Prepare the state including items on the scene
-        items_data = []
-        for item in self.scene.items():
-            if isinstance(item, (DraggableCircleItem, DraggableRectangleItem, DraggableTextItem, DraggableLineItem)):
-                # Save the item type and position
-                item_type = type(item).__name__
-                pos = item.pos()
-                item_data = {
-                    'type': item_type,
-                    'pos': (pos.x(), pos.y()),
-                    'zValue': item.zValue()
-                }
-                
-                if isinstance(item, DraggableTextItem):
-                    item_data['text'] = item.toPlainText()
-                    item_data['font'] = item.font().toString()
-                    item_data['color'] = item.defaultTextColor().name()
-                
-                elif isinstance(item, DraggableCircleItem):
-                    rect = item.rect()
-                    item_data['width'] = rect.width()
-                    item_data['height'] = rect.height()
-                    item_data['pen'] = {
-                        'color': item.pen().color().name(),
-                        'width': item.pen().width(),
-                        'style': item.pen().style(),
-                        'cap': item.pen().capStyle(),
-                        'join': item.pen().joinStyle()
-                    }
-                    brush = item.brush()
-                    if brush.style() == Qt.NoBrush:
-                        item_data['brush_style'] = Qt.NoBrush
-                    else:
-                        item_data['brush_style'] = brush.style()
-                        item_data['brush_color'] = brush.color().name()
-                
-                elif isinstance(item, DraggableRectangleItem):
-                    rect = item.rect()
-                    item_data['width'] = rect.width()
-                    item_data['height'] = rect.height()
-                    item_data['pen'] = {
-                        'color': item.pen().color().name(),
-                        'width': item.pen().width(),
-                        'style': item.pen().style(),
-                        'cap': item.pen().capStyle(),
-                        'join': item.pen().joinStyle()
-                    }
-
-                    brush = item.brush()
-                    if brush.style() == Qt.NoBrush:
-                        item_data['brush_style'] = Qt.NoBrush
-                    else:
-                        item_data['brush_style'] = brush.style()
-                        item_data['brush_color'] = brush.color().name()
-                
-                elif isinstance(item, DraggableLineItem):
-                    line = item.line()
-                    item_data['x1'] = line.x1()
-                    item_data['y1'] = line.y1()
-                    item_data['x2'] = line.x2()
-                    item_data['y2'] = line.y2()
-                    item_data['pen'] = {
-                        'color': item.pen().color().name(),
-                        'width': item.pen().width(),
-                        'style': item.pen().style(),
-                        'cap': item.pen().capStyle(),
-                        'join': item.pen().joinStyle()
-                    }
-                
-                items_data.append(item_data)
-            
-            # Currently, we are not saving the state for these item types
-            # elif isinstance(item, (DraggablePathItem, DraggablePolygonItem, DraggablePixmapItem)):
-                # Code to save the state of these items will go here
-                # DraggablePathItem için:
-                # For DraggablePathItem:
-                #   item_data['path_type'] = 'simple'
-                #   item_data['pen'] = { 'color': item.pen().color().name(), ... }
-                # 
-                # DraggablePixmapItem için:
-                #   pixmap = item.pixmap()
-                #   byte_array = QByteArray()
-                #   buffer = QBuffer(byte_array)
-                #   buffer.open(QBuffer.WriteOnly)
-                #   pixmap.save(buffer, "PNG")
-                #   item_data['pixmap_base64'] = str(byte_array.toBase64())
-                #
-                # DraggablePolygonItem için:
-                #   polygon = item.polygon()
-                #   points = []
-                #   for i in range(polygon.count()):
-                #       point = polygon.at(i)
-                #       points.append((point.x(), point.y()))
-                #   item_data['points'] = points
-                #   item_data['pen'] = { 'color': item.pen().color().name(), ... }
-                #   brush = item.brush()
-                #   if brush.style() == Qt.NoBrush:
-                #       item_data['brush_style'] = Qt.NoBrush
-                #   else:
-                #       item_data['brush_style'] = brush.style()
-                #       item_data['brush_color'] = brush.color().name()
+        # Only the items changed since the last entry are serialized
+        items_data = self._record_item_changes()
         
-        # Prepare the undo state
+        # Prepare the undo state; only the pixels that changed are kept
         state = {
-            'image': self.image.copy() if self.image is not None else None,
-            'items': items_data
+            'items': items_data,  # Item journal: (item id, data before, data after); None data means absent
+            'rect': None,  # Where this image differs from the previous state, None if nowhere
+            'pixels': None,  # The other side of the change: before it while applied, after it once undone
+            'full': False,  # pixels is a whole image because the size changed
+            'command': command,  # (function to apply next, the other one) for reversible operations
+            'pending': False  # The history worker still owns pixels
         }
+        self._wait_for_history()  # The last capture may still be bringing history_image up to date
+        if command is not None:
+            self.history_image = self.share_image(self.image)
+            state['rect'] = self.WHOLE_IMAGE
+        else:
+            self._record_pixels(state)
+        self.dirty_rect = None
         
         # Debug the current state
         self.emit_debug(f"save_state called: history length={len(self.history)}, current_index={self.current_history_index}", DebugLevel.INFO)
-        self.emit_debug(f"Number of items saved: {len(items_data)}", DebugLevel.INFO)
+        self.emit_debug(f"Number of item changes saved: {len(items_data)}", DebugLevel.INFO)
         
         # Update the history list
         # If there were changes made that created space for redo, clear them
         if self.current_history_index < len(self.history) - 1:
             old_length = len(self.history)
+            for dropped in self.history[self.current_history_index + 1:]:
+                self._free_entry_pixels(dropped)
             self.history = self.history[:self.current_history_index + 1]
             self.emit_debug(f"History truncated: {old_length} -> {len(self.history)}", DebugLevel.INFO)
         
@@ -1288,17 +1411,218 @@ class CustomGraphicsView(QGraphicsView):
         self.current_history_index = len(self.history) - 1
         self.emit_debug(f"New state added, new index: {self.current_history_index}, history length: {len(self.history)}", DebugLevel.INFO)
         
-        # Check history size
-        if len(self.history) > self.max_history_size:
-            self.history.pop(0)
-            self.current_history_index -= 1
-            self.emit_debug(f"History size limited, new index: {self.current_history_index}", DebugLevel.INFO)
+        self._enforce_history_budget()
         
         # Update signals
         self.undoStateChanged.emit(self.can_undo())
         self.redoStateChanged.emit(self.can_redo())
         self.emit_debug(f"Durum geçmişe kaydedildi: can_undo={self.can_undo()}, can_redo={self.can_redo()}", DebugLevel.INFO)
     
+    def begin_history_transaction(self):
+        """Starts grouping save_state calls into one history entry; transactions nest."""
+        self._transaction_depth += 1
+
+    def commit_history_transaction(self):
+        """Ends a transaction; the outermost one saves a single entry if anything inside saved."""
+        self._transaction_depth -= 1
+        if self._transaction_depth:
+            return
+        changes, self._transaction_changes = self._transaction_changes, []
+        if not changes:
+            return
+        if len(changes) == 1 and changes[0] is not None and self.dirty_rect is None:
+            self.save_state(command=changes[0])
+            return
+        if any(command is not None for command in changes):
+            # A reversible operation merged with other changes is recorded by its pixels
+            self.mark_dirty()
+        self.save_state()
+
+    @contextmanager
+    def history_transaction(self):
+        """Context manager around begin/commit_history_transaction: everything inside is one undo step."""
+        self.begin_history_transaction()
+        try:
+            yield
+        finally:
+            self.commit_history_transaction()
+
+    def _wait_for_history(self, state=None):
+        """Waits for the history worker if history_image, or the pixels of state, are still being captured."""
+        if not ((self._capture_state is not None and self._capture_state['pending'])
+                or (state is not None and state['pending'])):
+            return
+        waited = self.history_worker.wait()
+        self.emit_debug(f"Waited {waited * 1000:.1f} ms for history snapshots", DebugLevel.DEBUG)
+
+    def _on_history_job_finished(self, message):
+        if message:
+            self.emit_debug(f"Error saving history pixels: {message}", DebugLevel.ERROR)
+        if not self.history_worker.busy():
+            self._enforce_history_budget()  # Also shows the usage now that the spills are done
+
+    def _clear_history(self):
+        self._transaction_changes = []  # Changes to the previous image are gone with its history
+        self.history_worker.wait()
+        self._capture_state = None
+        for state in self.history:
+            self._free_entry_pixels(state)
+        self.history = []
+        self.current_history_index = -1
+        self.history_image = None
+        self._reset_item_journal()
+        self.historyUsageChanged.emit(0, 0, 0)
+
+    def _free_entry_pixels(self, state):
+        self._wait_for_history(state)
+        if isinstance(state['pixels'], SpilledArray):
+            self.history_spill.discard(state['pixels'])
+        state['pixels'] = None
+
+    def history_usage(self):
+        """Returns (bytes of entry pixels in memory, compressed bytes spilled to disk)."""
+        memory = sum(state['pixels'].nbytes for state in self.history
+                     if state['pixels'] is not None and not isinstance(state['pixels'], SpilledArray))
+        return memory, self.history_spill.disk_bytes
+
+    def set_history_budget(self, memory_bytes, disk_bytes=None):
+        """Changes the history budgets and applies them right away."""
+        self.history_memory_budget = memory_bytes
+        if disk_bytes is not None:
+            self.history_disk_budget = disk_bytes
+        self._enforce_history_budget()
+
+    def _enforce_history_budget(self):
+        """Spills entry pixels over the memory budget to disk and drops entries over the disk budget."""
+        memory, disk = self.history_usage()
+        if memory > self.history_memory_budget:
+            # Farthest from the current entry first: those are the last to be needed again
+            # Entries already on their way to disk no longer count
+            memory -= sum(state['pixels'].nbytes for state in self.history if state['pending']
+                          and state['pixels'] is not None and not isinstance(state['pixels'], SpilledArray))
+            in_memory = [index for index, state in enumerate(self.history) if not state['pending']
+                         and state['pixels'] is not None and not isinstance(state['pixels'], SpilledArray)]
+            in_memory.sort(key=lambda index: abs(index - self.current_history_index), reverse=True)
+            for index in in_memory:
+                if memory <= self.history_memory_budget:
+                    break
+                state = self.history[index]
+                memory -= state['pixels'].nbytes
+                self.history_worker.submit(state, lambda state=state: self._spill_entry(state))
+                self.emit_debug(f"History entry {index} queued to spill {state['pixels'].nbytes} bytes to disk",
+                                DebugLevel.DEBUG)
+
+        # Disk usage is only known once the spills are written; _on_history_job_finished comes back here
+        while (not self.history_worker.busy() and self.history_spill.disk_bytes > self.history_disk_budget
+               and len(self.history) > 1):
+            # Give up the end farther from the current entry
+            if self.current_history_index >= len(self.history) - 1 - self.current_history_index:
+                self._free_entry_pixels(self.history.pop(0))
+                self._free_entry_pixels(self.history[0])  # The first entry is never undone
+                self.current_history_index -= 1
+            else:
+                self._free_entry_pixels(self.history.pop())
+            self.emit_debug(f"History over its disk budget, {len(self.history)} entries left", DebugLevel.INFO)
+
+        memory, disk = self.history_usage()
+        self.historyUsageChanged.emit(len(self.history), memory, disk)
+
+    def _spill_entry(self, state):
+        """Runs on the history worker: compresses state's pixels to disk."""
+        state['pixels'] = self.history_spill.store(state['pixels'])
+
+    def _clip_to_image(self, rect):
+        """Returns rect=(x, y, width, height) clipped to self.image, or None if nothing is left."""
+        if rect is None:
+            return None
+        height, width = self.image.shape[:2]
+        left, top = max(0, rect[0]), max(0, rect[1])
+        right, bottom = min(width, rect[0] + rect[2]), min(height, rect[1] + rect[3])
+        if right <= left or bottom <= top:
+            return None
+        return left, top, right - left, bottom - top
+
+    def _record_pixels(self, state):
+        """Brings history_image up to date with self.image and fills in rect, pixels and full of a new entry.
+
+        pixels are the previous pixels inside rect, or the whole previous
+        image (None for the first entry) when the size changed. When all of
+        the image changed, the previous buffer moves into the entry and the
+        current one is shared instead of copied. Otherwise only the changed
+        region is copied here; the history worker does the rest.
+        """
+        previous = self.history_image
+        if previous is None or previous.shape != self.image.shape:
+            self.history_image = self.share_image(self.image)
+            state.update(rect=self.WHOLE_IMAGE, pixels=previous, full=True)
+            return
+        rect = self._clip_to_image(self.dirty_rect)
+        if rect is None:
+            return
+        state['rect'] = rect
+        if self._covers_image(rect):
+            self.history_image = self.share_image(self.image)
+            state['pixels'] = previous
+            return
+        x, y, width, height = rect
+        region = (slice(y, y + height), slice(x, x + width))
+        changed = self.copy_image(self.image[region])  # self.image may be painted on again before the worker runs
+
+        def capture():
+            state['pixels'] = self.copy_image(previous[region])
+            history_image = self.writable_image(previous)
+            history_image[region] = changed
+            self.history_image = history_image
+
+        self._capture_state = state
+        self.history_worker.submit(state, capture)
+
+    def _revert_unsaved(self):
+        """Puts back the pixels changed since the last save_state; returns the rect to repaint."""
+        rect = self._clip_to_image(self.dirty_rect)
+        self.dirty_rect = None
+        if self.image.shape != self.history_image.shape or (rect is not None and self._covers_image(rect)):
+            self.image = self.share_image(self.history_image)
+            return self.WHOLE_IMAGE
+        if rect is not None:
+            self.image = self.writable_image(self.image)
+            x, y, width, height = rect
+            region = (slice(y, y + height), slice(x, x + width))
+            self.image[region] = self.history_image[region]
+        return rect
+
+    def _swap_history_pixels(self, state):
+        """Applies the pixels kept by a history entry and keeps the ones they replace instead.
+
+        Command entries apply their next function and keep the other one.
+        Undoing an entry and redoing it are the same swap. Returns the rect
+        to repaint, None if the image did not change.
+        """
+        if state['command'] is not None:
+            apply, other = state['command']
+            self.history_image = self.image = self.share_image(self._to_storage(apply(self.history_image)))
+            state['command'] = (other, apply)
+            return self.WHOLE_IMAGE
+        self._wait_for_history(state)
+        if isinstance(state['pixels'], SpilledArray):
+            state['pixels'] = self.history_spill.load(state['pixels'])
+        if state['full'] or (state['rect'] is not None and self._covers_image(state['rect'])):
+            # Whole buffers trade places; nothing is copied
+            state['pixels'], self.history_image = self.history_image, self.share_image(state['pixels'])
+            self.image = self.history_image
+            return self.WHOLE_IMAGE
+        if state['rect'] is None:
+            return None
+        x, y, width, height = state['rect']
+        region = (slice(y, y + height), slice(x, x + width))
+        replaced = self.copy_image(self.history_image[region])
+        self.history_image = self.writable_image(self.history_image)
+        self.image = self.writable_image(self.image)
+        self.history_image[region] = state['pixels']
+        self.image[region] = state['pixels']
+        state['pixels'] = replaced
+        return state['rect']
+
     def can_undo(self):
         """Checks if the undo operation is possible"""
         return self.current_history_index > 0
@@ -1318,30 +1642,31 @@ class CustomGraphicsView(QGraphicsView):
         # Print current state for debugging
         if self.current_history_index >= 0 and self.current_history_index < len(self.history):
             current_state = self.history[self.current_history_index]
-            current_image_shape = current_state['image'].shape if current_state['image'] is not None else "None"
-            self.emit_debug(f"Current state: index={self.current_history_index}, image shape={current_image_shape}, items={len(current_state['items'])}", DebugLevel.INFO)
+            self.emit_debug(f"Current state: index={self.current_history_index}, image shape={self.image.shape}, item changes={len(current_state['items'])}", DebugLevel.INFO)
         
         # Go to the previous state
         self.current_history_index -= 1
         state = self.history[self.current_history_index]
         
         # Print target state for debugging
-        target_image_shape = state['image'].shape if state['image'] is not None else "None"
-        self.emit_debug(f"Target state: index={self.current_history_index}, image shape={target_image_shape}, items={len(state['items'])}", DebugLevel.INFO)
+        self.emit_debug(f"Target state: index={self.current_history_index}, changed rect={state['rect']}, item changes={len(state['items'])}", DebugLevel.INFO)
         
-        # Clear draggable items from the scene
-        self._clear_draggable_items()
-        
-        # Restore the image
-        if state['image'] is not None:
-            self.image = state['image'].copy()
-            self.update_view()
+        # Restore the image by undoing the unsaved changes and the entry we leave
+        self._wait_for_history()
+        if self.image is not None and self.history_image is not None:
+            # Only the changes made since the state we leave, and by that state itself, need redrawing
+            rect = self._revert_unsaved()
+            rect = self.union_rect(rect, self._swap_history_pixels(self.history[self.current_history_index + 1]))
+            if rect is not None:
+                self.update_view(rect)
             self.emit_debug(f"Image restored, shape={self.image.shape}", DebugLevel.INFO)
         else:
             self.emit_debug("No image to restore!", DebugLevel.ERROR)
         
-        # Restore items
-        self._restore_items(state['items'])
+        # Restore items: drop unsaved item changes, then play the journal of the entry we leave backwards
+        self._revert_item_changes()
+        self._apply_item_journal(self.history[self.current_history_index + 1]['items'], undo=True)
+        self._enforce_history_budget()  # Entries brought back from disk count against the budget again
         
         self.undoStateChanged.emit(self.can_undo())
         self.redoStateChanged.emit(self.can_redo())
@@ -1358,189 +1683,166 @@ class CustomGraphicsView(QGraphicsView):
         # Print current state for debugging
         if self.current_history_index >= 0 and self.current_history_index < len(self.history):
             current_state = self.history[self.current_history_index]
-            current_image_shape = current_state['image'].shape if current_state['image'] is not None else "None"
-            self.emit_debug(f"Current state: index={self.current_history_index}, image shape={current_image_shape}, items={len(current_state['items'])}", DebugLevel.INFO)
+            self.emit_debug(f"Current state: index={self.current_history_index}, image shape={self.image.shape}, item changes={len(current_state['items'])}", DebugLevel.INFO)
         
         # Go to the next state
         self.current_history_index += 1
         state = self.history[self.current_history_index]
         
         # Print target state for debugging
-        target_image_shape = state['image'].shape if state['image'] is not None else "None"
-        self.emit_debug(f"Hedef durum: index={self.current_history_index}, image shape={target_image_shape}, items={len(state['items'])}", DebugLevel.INFO)
-        self.emit_debug(f"Target state: index={self.current_history_index}, image shape={target_image_shape}, items={len(state['items'])}", DebugLevel.INFO)
-        
-        # Clear draggable items from the scene
-        self._clear_draggable_items()
+        self.emit_debug(f"Target state: index={self.current_history_index}, changed rect={state['rect']}, item changes={len(state['items'])}", DebugLevel.INFO)
         
         # Restore the image (forward)
-        if state['image'] is not None:
-            self.image = state['image'].copy()
-            self.update_view()
+        self._wait_for_history()
+        if self.image is not None and self.history_image is not None:
+            rect = self._revert_unsaved()
+            rect = self.union_rect(rect, self._swap_history_pixels(state))
+            if rect is not None:
+                self.update_view(rect)
             self.emit_debug(f"Image restored (redo), shape={self.image.shape}", DebugLevel.INFO)
         else:
             self.emit_debug("No image to restore (redo)!", DebugLevel.ERROR)
         
         # Restore items
-        self._restore_items(state['items'])
+        self._revert_item_changes()
+        self._apply_item_journal(state['items'], undo=False)
+        self._enforce_history_budget()  # Entries brought back from disk count against the budget again
         
         self.undoStateChanged.emit(self.can_undo())
         self.redoStateChanged.emit(self.can_redo())
         self.emit_debug(f"Operation redone, new state: can_undo={self.can_undo()}, can_redo={self.can_redo()}", DebugLevel.INFO)
     
-    def _clear_draggable_items(self):
+    def note_item_change(self, item):
+        """Marks item as added, moved, restyled or removed since the last save_state.
 
-        """Clears all draggable items from the scene"""
-        items_to_remove = []
+        Only noted items are serialized by the next save_state, so every
+        place that changes an annotation item has to call this.
+        """
+        if not isinstance(item, self.JOURNALED_ITEM_TYPES):
+            return
+        item_id = getattr(item, 'history_id', None)
+        if item_id is None:
+            item_id = item.history_id = self._next_item_id
+            self._next_item_id += 1
+            if isinstance(item, DraggableTextItem):
+                # Typing into a text item changes it without any other notice
+                item.document().contentsChanged.connect(lambda item=item: self.note_item_change(item))
+        self.items_by_id[item_id] = item  # Removed items stay here so undo can put the same object back
+        self.changed_items.add(item_id)
+
+    def _reset_item_journal(self):
+        """Forgets the journal and takes the items now in the scene as the starting point."""
+        self.items_by_id = {}
+        self.item_states = {}
+        self.changed_items = set()
         for item in self.scene.items():
+            self.note_item_change(item)
+        self._record_item_changes()
 
-            # For now, we only clear the item types we support
-            if isinstance(item, (DraggableCircleItem, DraggableRectangleItem, DraggableTextItem, DraggableLineItem)):
-                items_to_remove.append(item)
-            
-
-            # NOTE: Currently not processing DraggablePathItem, DraggablePolygonItem, DraggablePixmapItem
-            # elif isinstance(item, (DraggablePathItem, DraggablePolygonItem, DraggablePixmapItem)):
-            #     items_to_remove.append(item)
-        
-        for item in items_to_remove:
-            self.scene.removeItem(item)
-        
-
-        self.emit_debug(f"{len(items_to_remove)} items cleared from scene", DebugLevel.INFO)
-
-    def _restore_items(self, items_data):
-
-        """Restores saved items to the scene"""
-        if not items_data:
+    @staticmethod
+    def _pen_data(pen):
+        return {
+            'color': pen.color().name(),
+            'width': pen.width(),
+            'style': pen.style(),
+            'cap': pen.capStyle(),
+            'join': pen.joinStyle()
+        }
 
-            self.emit_debug("No items to restore", DebugLevel.INFO)
+    def _item_data(self, item):
+        """Serializes one annotation item into a dict of plain values."""
+        pos = item.pos()
+        item_data = {
+            'type': type(item).__name__,
+            'pos': (pos.x(), pos.y()),
+            'zValue': item.zValue()
+        }
+        if isinstance(item, DraggableTextItem):
+            item_data['text'] = item.toPlainText()
+            item_data['font'] = item.font().toString()
+            item_data['color'] = item.defaultTextColor().name()
+        elif isinstance(item, DraggableLineItem):
+            line = item.line()
+            item_data['x1'] = line.x1()
+            item_data['y1'] = line.y1()
+            item_data['x2'] = line.x2()
+            item_data['y2'] = line.y2()
+            item_data['pen'] = self._pen_data(item.pen())
+        else:  # DraggableCircleItem, DraggableRectangleItem
+            rect = item.rect()
+            item_data['rect'] = (rect.x(), rect.y(), rect.width(), rect.height())
+            item_data['pen'] = self._pen_data(item.pen())
+            brush = item.brush()
+            item_data['brush_style'] = brush.style()
+            if brush.style() != Qt.NoBrush:
+                item_data['brush_color'] = brush.color().name()
+        return item_data
+
+    def _set_item_data(self, item, item_data):
+        """Changes an existing item in place to match _item_data."""
+        item.setPos(*item_data['pos'])
+        item.setZValue(item_data['zValue'])
+        if isinstance(item, DraggableTextItem):
+            if item.toPlainText() != item_data['text']:
+                item.setPlainText(item_data['text'])
+            font = QFont()
+            font.fromString(item_data['font'])
+            item.setFont(font)
+            item.setDefaultTextColor(QColor(item_data['color']))
             return
-        
-        restored_count = 0
-        for item_data in items_data:
-            try:
-                item_type = item_data['type']
-                pos_x, pos_y = item_data['pos']
-                
-
-                # Recreate item based on type
-                if item_type == 'DraggableTextItem' and 'text' in item_data:
-                    item = DraggableTextItem(item_data['text'])
-                    if 'font' in item_data:
-                        font = QFont()
-                        font.fromString(item_data['font'])
-                        item.setFont(font)
-                    if 'color' in item_data:
-                        item.setDefaultTextColor(QColor(item_data['color']))
-                
-                elif item_type == 'DraggableCircleItem' and 'width' in item_data and 'height' in item_data:
-                    item = DraggableCircleItem(0, 0, item_data['width'], item_data['height'])
-                    if 'pen' in item_data:
-                        pen_data = item_data['pen']
-                        pen = QPen(QColor(pen_data['color']), pen_data['width'], 
-                                pen_data['style'], pen_data['cap'], pen_data['join'])
-                        item.setPen(pen)
-                    
-                    # Restore brush style correctly
-                    if 'brush_style' in item_data:
-                        if item_data['brush_style'] == Qt.NoBrush:
-                            item.setBrush(QBrush())
-                        elif 'brush_color' in item_data:
-                            brush = QBrush(QColor(item_data['brush_color']), item_data['brush_style'])
-                            item.setBrush(brush)
-                
-                elif item_type == 'DraggableRectangleItem' and 'width' in item_data and 'height' in item_data:
-                    item = DraggableRectangleItem(0, 0, item_data['width'], item_data['height'])
-                    if 'pen' in item_data:
-                        pen_data = item_data['pen']
-                        pen = QPen(QColor(pen_data['color']), pen_data['width'], 
-                                pen_data['style'], pen_data['cap'], pen_data['join'])
-                        item.setPen(pen)
-                    
-                    # Restore brush style correctly
-                    if 'brush_style' in item_data:
-                        if item_data['brush_style'] == Qt.NoBrush:
-                            item.setBrush(QBrush())
-                        elif 'brush_color' in item_data:
-                            brush = QBrush(QColor(item_data['brush_color']), item_data['brush_style'])
-                            item.setBrush(brush)
-                
-                elif item_type == 'DraggableLineItem' and all(k in item_data for k in ['x1', 'y1', 'x2', 'y2']):
-                    item = DraggableLineItem(item_data['x1'], item_data['y1'], item_data['x2'], item_data['y2'])
-                    if 'pen' in item_data:
-                        pen_data = item_data['pen']
-                        pen = QPen(QColor(pen_data['color']), pen_data['width'], 
-                                pen_data['style'], pen_data['cap'], pen_data['join'])
-                        item.setPen(pen)
-                
-                elif item_type == 'DraggablePathItem' and 'path_type' in item_data:
-
-                    # NOTE: Currently disabling restore for path
-
-                    self.emit_debug(f"Path restore operation is not currently supported", DebugLevel.WARNING)
-                    continue
-                
-                elif item_type == 'DraggablePixmapItem' and 'pixmap_base64' in item_data:
-                    byte_array = QByteArray.fromBase64(item_data['pixmap_base64'].encode())
-                    pixmap = QPixmap()
-                    pixmap.loadFromData(byte_array, "PNG")
-                    item = DraggablePixmapItem(pixmap)
-                
-                elif item_type == 'DraggablePolygonItem' and 'points' in item_data:
-                    points_list = item_data['points']
-                    polygon = QPolygonF()
-                    for point_x, point_y in points_list:
-                        polygon.append(QPointF(point_x, point_y))
-                    item = DraggablePolygonItem(polygon)
-                    if 'pen' in item_data:
-                        pen_data = item_data['pen']
-                        pen = QPen(QColor(pen_data['color']), pen_data['width'], 
-                                pen_data['style'], pen_data['cap'], pen_data['join'])
-                        item.setPen(pen)
-                    
-                    # Restore brush style correctly
-                    if 'brush_style' in item_data:
-                        if item_data['brush_style'] == Qt.NoBrush:
-                            item.setBrush(QBrush())
-                        elif 'brush_color' in item_data:
-                            brush = QBrush(QColor(item_data['brush_color']), item_data['brush_style'])
-                            item.setBrush(brush)
-                
-                # We are currently adding basic support for DraggablePathItem
-                # Full vector data support might be more complex
-                elif item_type == 'DraggablePathItem' and 'path_type' in item_data:
-                    # For simple paths for now
-                    # if item_data['path_type'] == 'simple':
-                    #     path = QPainterPath()
-                    #     path.moveTo(0, 0)
-                    #     path.lineTo(50, 50)  # A simple line for now
-                    #     item = DraggablePathItem(path)
-                    #     if 'pen' in item_data:
-                    #         pen_data = item_data['pen']
-                    #         pen = QPen(QColor(pen_data['color']), pen_data['width'], 
-                    #                 pen_data['style'], pen_data['cap'], pen_data['join'])
-                    #         item.setPen(pen)
-
-                    self.emit_debug(f"Path restore operation is not currently supported", DebugLevel.WARNING)
-                else:
-
-                    self.emit_debug(f"Unsupported item type or missing data: {item_type}", DebugLevel.WARNING)
-                    continue
-                
-                # Öğeyi sahneye ekle
-                item.setPos(pos_x, pos_y)
-                if 'zValue' in item_data:
-                    item.setZValue(item_data['zValue'])
-                self.scene.addItem(item)
-                restored_count += 1
-                
-            except Exception as e:
-
-                self.emit_debug(f"Error restoring item: {str(e)}", DebugLevel.ERROR)
-                self.emit_debug(traceback.format_exc(), DebugLevel.ERROR)
-        
+        pen_data = item_data['pen']
+        item.setPen(QPen(QColor(pen_data['color']), pen_data['width'],
+                         pen_data['style'], pen_data['cap'], pen_data['join']))
+        if isinstance(item, DraggableLineItem):
+            item.setLine(item_data['x1'], item_data['y1'], item_data['x2'], item_data['y2'])
+        else:
+            item.setRect(*item_data['rect'])
+            if item_data['brush_style'] == Qt.NoBrush:
+                item.setBrush(QBrush())
+            else:
+                item.setBrush(QBrush(QColor(item_data['brush_color']), item_data['brush_style']))
+
+    def _record_item_changes(self):
+        """Serializes the items noted since the last save_state; returns their journal entries."""
+        journal = []
+        for item_id in sorted(self.changed_items):
+            item = self.items_by_id[item_id]
+            after = self._item_data(item) if item.scene() is self.scene else None
+            before = self.item_states.get(item_id)
+            if after == before:
+                continue
+            journal.append((item_id, before, after))
+            if after is None:
+                del self.item_states[item_id]
+            else:
+                self.item_states[item_id] = after
+        self.changed_items.clear()
+        return journal
+
+    def _apply_item_data(self, item_id, item_data):
+        """Brings one item to item_data in place; None takes it out of the scene, and it is put back later."""
+        item = self.items_by_id[item_id]
+        if item_data is None:
+            if item.scene() is self.scene:
+                self.scene.removeItem(item)
+            self.item_states.pop(item_id, None)
+            return
+        self._set_item_data(item, item_data)
+        if item.scene() is not self.scene:
+            self.scene.addItem(item)
+        self.item_states[item_id] = item_data
+
+    def _revert_item_changes(self):
+        """Puts the items changed since the last save_state back as they were."""
+        for item_id in sorted(self.changed_items):
+            self._apply_item_data(item_id, self.item_states.get(item_id))
+        self.changed_items.clear()
+
+    def _apply_item_journal(self, journal, undo):
+        """Plays an entry's item journal backwards (undo) or forwards (redo)."""
+        for item_id, before, after in (reversed(journal) if undo else journal):
+            self._apply_item_data(item_id, before if undo else after)
+        self.changed_items.clear()  # Setting text notes a change of its own
+        self.emit_debug(f"{len(journal)} item changes {'undone' if undo else 'redone'}", DebugLevel.INFO)
 
-        self.emit_debug(f"{restored_count} items restored successfully", DebugLevel.INFO)
-    
     # endregion
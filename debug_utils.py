@@ -112,6 +112,10 @@ class DebugWidget(QWidget):
         filter_panel.addStretch()
         layout.addLayout(filter_panel)
         
+        # Undo history memory use, kept up to date by MainWindow
+        self.history_label = QLabel("History: no image")
+        layout.addWidget(self.history_label)
+
         # Debug messages list
         self.message_list = QListWidget()
         self.message_list.setAlternatingRowColors(True)
@@ -172,6 +176,10 @@ class DebugWidget(QWidget):
             }
         """)
 
+    def set_history_usage(self, entries, memory_bytes, disk_bytes):
+        self.history_label.setText(f"History: {entries} entries, {memory_bytes / 2 ** 20:.1f} MB in memory, "
+                                   f"{disk_bytes / 2 ** 20:.1f} MB on disk")
+
     def show_context_menu(self, position):
         menu = QMenu()
         
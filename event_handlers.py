@@ -7,7 +7,7 @@ from image_operations import ImageOperations
 from vcolorpicker import getColor
 from debug_types import DebugLevel
 
-IMAGE_FILE_FILTER = "Image Files (*.png *.jpg *.bmp *.jpeg)" # Defined here for handlers
+IMAGE_FILE_FILTER = "Image Files (*.png *.jpg *.bmp *.jpeg *.tif *.tiff)" # Defined here for handlers
 
 class EventHandlers:
     def __init__(self, main_window):
@@ -19,24 +19,29 @@ class EventHandlers:
         try:
             filename, _ = QFileDialog.getOpenFileName(mw, "Select Image", "", IMAGE_FILE_FILTER)
             if filename:
-                image = ImageOperations.open_image(filename)
-                if image is None:
-                     mw.show_debug_info(f"Failed to load image from {filename}", DebugLevel.ERROR)
-                     QMessageBox.warning(mw, "Error", f"Could not load image file: {filename}")
-                     return
-                mw.view.set_image(image, is_new_image=True)
-                mw.adjustments.reset()
-                mw.reset_sliders() # Call main window's method
-                mw.view.update_view()
-                mw.statusBar().showMessage(f'Opened {filename}')
-                mw.show_debug_info(f"Image opened: {filename}", DebugLevel.INFO)
+                mw.image_loader.open(filename)
         except Exception as e:
             mw.statusBar().showMessage(f'Error opening image: {str(e)}')
             mw.show_debug_info(f"Error opening image: {str(e)}", DebugLevel.ERROR)
             QMessageBox.critical(mw, "Error", f"An unexpected error occurred while opening the image: {str(e)}")
 
+    def show_opened_image(self, filename, image, out_of_core=False):
+        """Makes a decoded file the current image; image is None if it could not be read."""
+        mw = self.mw
+        if image is None:
+            mw.show_debug_info(f"Failed to load image from {filename}", DebugLevel.ERROR)
+            QMessageBox.warning(mw, "Error", f"Could not load image file: {filename}")
+            return
+        mw.view.set_image(image, is_new_image=True, out_of_core=out_of_core)
+        mw.adjustments.reset()
+        mw.reset_sliders() # Call main window's method
+        mw.view.update_view()
+        mw.statusBar().showMessage(f'Opened {filename}')
+        mw.show_debug_info(f"Image opened: {filename}", DebugLevel.INFO)
+
     def save_image(self):
         mw = self.mw
+        self.commit_adjustments()
         if mw.view.image is None:
             mw.show_debug_info("No image to save", DebugLevel.WARNING)
             QMessageBox.information(mw, "Save Image", "There is no image to save.")
@@ -66,14 +71,13 @@ class EventHandlers:
                 elif selected_filter.startswith("BMP") and not ext.lower() == '.bmp':
                     filename = name + '.bmp'
                     
-                success = cv2.imwrite(filename, mw.view.rendered_image)
-                if success:
-                    mw.statusBar().showMessage(f'Saved {filename}')
-                    mw.show_debug_info(f"Image saved to {filename}", DebugLevel.INFO)
-                else:
-                    mw.statusBar().showMessage('Failed to save image')
-                    mw.show_debug_info(f"Failed to save image to {filename} (cv2.imwrite returned False)", DebugLevel.ERROR)
-                    QMessageBox.warning(mw, "Save Error", f"Could not save the image to {filename}.")
+                if not mw.image_saver.ask_options(os.path.splitext(filename)[1].lower()):
+                    mw.show_debug_info("Save cancelled in the options dialog", DebugLevel.INFO)
+                    return
+                # The rendered image is read-only: either the view's shared image, which edits copy before
+                # writing to (see writable_image), or a copy with the items drawn in. The job can read it
+                # while editing goes on
+                mw.image_saver.save(filename, mw.view.rendered_image)
             except Exception as e:
                  mw.statusBar().showMessage(f'Error saving image: {str(e)}')
                  mw.show_debug_info(f"Error saving image to {filename}: {str(e)}", DebugLevel.ERROR)
@@ -85,6 +89,7 @@ class EventHandlers:
 
     def new_image(self):
         mw = self.mw
+        mw.image_loader.cancel()
         clipboard = QApplication.clipboard()
         mime_data = clipboard.mimeData()
         use_clipboard = False
@@ -163,16 +168,15 @@ class EventHandlers:
 
     def flip_image(self, axis):
         mw = self.mw
+        self.commit_adjustments()
         if mw.view.image is not None:
             try:
-                flipped_image = ImageOperations.flip(mw.view.image, axis)
-                mw.view.set_image(flipped_image)
-                mw.view.update_view()
+                # A flip is its own inverse, so undo needs no pixels
+                flip = lambda image: ImageOperations.flip(image, axis)
+                mw.view.apply_reversible(flip, flip)
                 axis_name = 'horizontally' if axis == 'Horizontal' else 'vertically'
                 mw.statusBar().showMessage(f'Flipped image {axis_name}')
                 mw.show_debug_info(f"Image flipped {axis_name}", DebugLevel.INFO)
-                # Save state after successful operation
-                mw.view.save_state()
             except Exception as e:
                  mw.show_debug_info(f"Error flipping image: {e}", DebugLevel.ERROR)
                  QMessageBox.warning(mw, "Flip Error", f"Could not flip image: {e}")
@@ -181,16 +185,16 @@ class EventHandlers:
 
     def rotate_image(self, direction):
         mw = self.mw
+        self.commit_adjustments()
         if mw.view.image is not None:
             try:
-                rotated_image = ImageOperations.rotate(mw.view.image, direction)
-                mw.view.set_image(rotated_image)
-                mw.view.update_view()
+                # Undone by rotating the other way, so undo needs no pixels
+                inverse = 'ccw' if direction == 'cw' else 'cw'
+                mw.view.apply_reversible(lambda image: ImageOperations.rotate(image, direction),
+                                         lambda image: ImageOperations.rotate(image, inverse))
                 direction_name = "clockwise" if direction == 'cw' else "counter-clockwise"
                 mw.statusBar().showMessage(f'Rotated image {direction_name}')
                 mw.show_debug_info(f"Image rotated {direction_name}", DebugLevel.INFO)
-                # Save state after successful operation
-                mw.view.save_state()
             except Exception as e:
                  mw.show_debug_info(f"Error rotating image: {e}", DebugLevel.ERROR)
                  QMessageBox.warning(mw, "Rotate Error", f"Could not rotate image: {e}")
@@ -209,6 +213,7 @@ class EventHandlers:
     # region Undo
     def undo(self):
         mw = self.mw
+        self.commit_adjustments()
         if hasattr(mw, 'view'):
             undone = mw.view.undo()
             if undone:
@@ -224,27 +229,45 @@ class EventHandlers:
         mw = self.mw
         if mw.view.original_image is not None:
              try:
-                mw.view.image = mw.adjustments.apply(mw.view.original_image)
-                mw.view.update_view()
+                # Previewed on a downscaled proxy; the full-resolution render runs in the background
+                mw.adjustment_preview.update()
                 mw.show_debug_info("Adjustments applied", DebugLevel.DEBUG)
                 # NOTE: Adjustments are often previewed live. Should save_state be called here?
                 # Probably better to save state when the user performs another action *after* adjusting.
              except Exception as e:
                  mw.show_debug_info(f"Error applying adjustments: {e}", DebugLevel.ERROR)
 
+    def render_adjustments(self):
+        """Queues the full-resolution render once a slider is released."""
+        mw = self.mw
+        try:
+            mw.adjustment_preview.render_full()
+        except Exception as e:
+            mw.show_debug_info(f"Error rendering adjustments: {e}", DebugLevel.ERROR)
+
+    def commit_adjustments(self):
+        """Finishes loading the image and renders any previewed adjustments before pixels are read."""
+        mw = self.mw
+        try:
+            mw.image_loader.wait()
+            mw.adjustment_preview.commit()
+        except Exception as e:
+            mw.show_debug_info(f"Error committing adjustments: {e}", DebugLevel.ERROR)
+
     def _apply_filter(self, filter_func, success_message):
         mw = self.mw
+        self.commit_adjustments()
         if mw.view.image is not None:
             try:
                 processed_image = filter_func(mw.view.image)
                 if processed_image is not None:
-                    mw.view.set_image(processed_image) # Updates original & view
+                    # One undo step for the filter, however many times the calls below save state
+                    with mw.view.history_transaction():
+                        mw.view.set_image(processed_image) # Updates original & view
+                        mw.adjustments.reset()
+                        mw.reset_sliders()
                     mw.statusBar().showMessage(success_message)
                     mw.show_debug_info(success_message, DebugLevel.INFO)
-                    mw.adjustments.reset()
-                    mw.reset_sliders()
-                    # Save state after successful filter application
-                    mw.view.save_state()
                 else:
                     mw.show_debug_info(f"Filter function {filter_func.__name__} returned None", DebugLevel.ERROR)
                     QMessageBox.warning(mw, "Filter Error", "The filter could not be applied.")
@@ -279,10 +302,14 @@ class EventHandlers:
 
     def reset_image(self):
         mw = self.mw
+        self.commit_adjustments()
         if mw.view.initial_image is not None:
-            mw.view.set_image(mw.view.initial_image.copy(), is_new_image=True)
-            mw.adjustments.reset()
-            mw.reset_sliders()
+            # One history entry for the reset image, however many times the calls below save state
+            with mw.view.history_transaction():
+                mw.view.set_image(mw.view.initial_image, is_new_image=True,
+                                  out_of_core=mw.view.out_of_core)
+                mw.adjustments.reset()
+                mw.reset_sliders()
             mw.statusBar().showMessage('Image and adjustments reset to initial state')
             mw.show_debug_info("Image reset to initial state.", DebugLevel.INFO)
         else:
@@ -400,6 +427,17 @@ class EventHandlers:
                 mw.brush_opacity_input.setText(str(mw.brush_opacity_slider.value()))
                 mw.show_debug_info(f"Invalid opacity input: {mw.brush_opacity_input.text()}", DebugLevel.WARNING)
 
+    def update_brush_hardness_from_input(self):
+        mw = self.mw
+        if mw.brush_hardness_input and mw.brush_hardness_slider:
+            try:
+                new_hardness = int(mw.brush_hardness_input.text())
+                new_hardness = max(0, min(100, new_hardness))
+                mw.brush_hardness_slider.setValue(new_hardness)
+            except ValueError:
+                mw.brush_hardness_input.setText(str(mw.brush_hardness_slider.value()))
+                mw.show_debug_info(f"Invalid hardness input: {mw.brush_hardness_input.text()}", DebugLevel.WARNING)
+
     def update_pen_style(self, index):
         mw = self.mw
         if mw.penStyleComboBox:
@@ -430,6 +468,8 @@ class EventHandlers:
         if mw.brush_size_input: mw.brush_size_input.setVisible(False)
         if mw.brush_opacity_slider: mw.brush_opacity_slider.setVisible(False)
         if mw.brush_opacity_input: mw.brush_opacity_input.setVisible(False)
+        if mw.brush_hardness_slider: mw.brush_hardness_slider.setVisible(False)
+        if mw.brush_hardness_input: mw.brush_hardness_input.setVisible(False)
         if mw.penStyleComboBox: mw.penStyleComboBox.setVisible(False)
         if mw.penCapComboBox: mw.penCapComboBox.setVisible(False)
         if mw.penJoinComboBox: mw.penJoinComboBox.setVisible(False)
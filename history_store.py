@@ -0,0 +1,156 @@
+# history_store.py
+
+import os
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class SpilledArray:
+    """Stands in for an array that HistorySpill compressed to disk."""
+
+    def __init__(self, path, shape, dtype, size):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.size = size  # Compressed bytes on disk
+        self.nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+class HistorySpill:
+    """Temporary directory of zlib-compressed arrays moved out of RAM by the undo history.
+
+    Arrays are streamed through the compressor a chunk at a time, so
+    spilling a large one does not need a second in-memory copy. The
+    directory is created on first use and removed with the object.
+    """
+    COMPRESSION_LEVEL = 1  # Fastest; image patches still shrink well
+    CHUNK_BYTES = 16 * 2 ** 20
+
+    def __init__(self, directory=None):
+        self.parent_directory = directory
+        self._directory = None
+        self._counter = 0
+        self._lock = threading.Lock()  # store() runs on the history worker, discard() on the GUI thread
+        self.disk_bytes = 0
+
+    def store(self, array):
+        """Compresses array into a new file and returns its SpilledArray."""
+        if self._directory is None:
+            self._directory = tempfile.TemporaryDirectory(prefix='pyqtshop-history-', dir=self.parent_directory)
+        self._counter += 1
+        path = os.path.join(self._directory.name, f"{self._counter}.zlib")
+        data = memoryview(np.ascontiguousarray(array)).cast('B')
+        compressor = zlib.compressobj(self.COMPRESSION_LEVEL)
+        size = 0
+        with open(path, 'wb') as f:
+            for offset in range(0, len(data), self.CHUNK_BYTES):
+                chunk = compressor.compress(data[offset:offset + self.CHUNK_BYTES])
+                f.write(chunk)
+                size += len(chunk)
+            chunk = compressor.flush()
+            f.write(chunk)
+            size += len(chunk)
+        with self._lock:
+            self.disk_bytes += size
+        return SpilledArray(path, array.shape, array.dtype, size)
+
+    def load(self, spilled):
+        """Decompresses a spilled array back into RAM and deletes its file."""
+        array = np.empty(spilled.shape, dtype=spilled.dtype)
+        target = memoryview(array).cast('B')
+        decompressor = zlib.decompressobj()
+        offset = 0
+        with open(spilled.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.CHUNK_BYTES)
+                if not chunk:
+                    break
+                data = decompressor.decompress(chunk)
+                target[offset:offset + len(data)] = data
+                offset += len(data)
+        data = decompressor.flush()
+        target[offset:offset + len(data)] = data
+        self.discard(spilled)
+        return array
+
+    def discard(self, spilled):
+        """Deletes a spilled array that is no longer needed."""
+        if os.path.exists(spilled.path):
+            os.remove(spilled.path)
+        with self._lock:
+            self.disk_bytes -= spilled.size
+
+
+class HistoryJobSignals(QObject):
+    finished = pyqtSignal(str)  # Error message, empty on success
+
+
+class HistoryJob(QRunnable):
+    """Runs one piece of bookkeeping for a history entry on the history worker thread."""
+
+    def __init__(self, state, work, done):
+        super().__init__()
+        self.state = state
+        self.work = work
+        self.done = done
+        self.signals = HistoryJobSignals()
+
+    def run(self):
+        message = ''
+        try:
+            self.work()
+        except Exception as e:
+            message = f"{e}\n{traceback.format_exc()}"
+        finally:
+            self.state['pending'] = False
+            self.done()
+        self.signals.finished.emit(message)
+
+
+class HistoryWorker(QObject):
+    """Copies and compresses history pixels on a background thread, one job at a time and in order.
+
+    While a job owns an entry's pixels the entry is marked 'pending'.
+    Code that needs those pixels calls wait() first, which returns at once
+    when nothing is queued.
+    """
+    jobFinished = pyqtSignal(str)  # Error message, empty on success
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._queued = 0
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def submit(self, state, work):
+        """Queues work(), which owns state's pixels until it returns."""
+        state['pending'] = True
+        job = HistoryJob(state, work, self._job_done)
+        job.signals.finished.connect(self.jobFinished)
+        with self._lock:
+            self._queued += 1
+        self.pool.start(job)
+
+    def _job_done(self):
+        with self._lock:
+            self._queued -= 1
+
+    def busy(self):
+        with self._lock:
+            return self._queued > 0
+
+    def wait(self):
+        """Blocks until every queued job is done; returns the seconds spent waiting."""
+        if not self.busy():
+            return 0.0
+        start = time.perf_counter()
+        self.pool.waitForDone()
+        return time.perf_counter() - start
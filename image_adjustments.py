@@ -1,11 +1,159 @@
 # image_adjustments.py
 
+import copy
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
+DEFAULT_CACHE_BUDGET = 512 * 1024 * 1024  # Bytes of stage outputs kept by StageCache
+TILE_TARGET_BYTES = 1024 * 1024  # Strip size aimed at staying cache-resident across the chain
+MIN_TILED_PIXELS = 2_000_000  # Smaller images are not worth splitting
+REGION_ALIGN = 32  # Column multiple for apply_region blocks, the widest SIMD step of cv2.cvtColor
+
+
+class StageCache:
+    """Byte-budgeted LRU cache of adjustment stage outputs.
+
+    Entries are keyed by the identity of the source image plus the parameters
+    of a stage and of every stage before it. Cached arrays are made read-only
+    because they are handed out again on later hits. Safe to share between threads.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.size_bytes = 0
+        self._entries = OrderedDict()  # (id(source), key) -> (weakref to source, array)
+        self._lock = threading.Lock()
+
+    def get(self, source, key):
+        """Returns the cached output for key computed from source, or None."""
+        with self._lock:
+            entry_key = (id(source), key)
+            entry = self._entries.get(entry_key)
+            if entry is None:
+                return None
+            if entry[0]() is not source:
+                # Source was freed and its id reused by another array
+                self._remove(entry_key)
+                return None
+            self._entries.move_to_end(entry_key)
+            return entry[1]
+
+    def put(self, source, key, array):
+        """Stores array as the output for key, evicting least recently used entries over budget."""
+        if array.nbytes > self.budget_bytes:
+            return
+        array.setflags(write=False)
+        with self._lock:
+            entry_key = (id(source), key)
+            if entry_key in self._entries:
+                self._remove(entry_key)
+            self._entries[entry_key] = (weakref.ref(source), array)
+            self.size_bytes += array.nbytes
+            while self.size_bytes > self.budget_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Drops every cached output."""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def _remove(self, entry_key):
+        _, array = self._entries.pop(entry_key)
+        self.size_bytes -= array.nbytes
+
+
+class TiledExecutor:
+    """Runs a chain of stages over horizontal strips of an image on a thread pool.
+
+    Each strip is pushed through every stage before the next strip starts, so
+    it stays in cache; OpenCV releases the GIL, so strips run in parallel.
+    Stages with a spatial kernel declare a halo: strips are read with that many
+    extra rows on each side and only their own rows are written out.
+    Intermediate results only exist per strip; full-size arrays are allocated
+    for the last stage and for the stages the caller asks to keep.
+    """
+
+    def __init__(self, tile_rows=None, num_threads=None):
+        self.tile_rows = tile_rows  # None picks rows so a strip is about TILE_TARGET_BYTES
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self._pool = None
+        self._pool_threads = None
+
+    def strip_rows(self, image):
+        """Returns the strip height used for image."""
+        if self.tile_rows:
+            return self.tile_rows
+        row_bytes = image.strides[0]
+        return max(16, TILE_TARGET_BYTES // max(1, row_bytes))
+
+    def _get_pool(self):
+        if self._pool is None or self._pool_threads != self.num_threads:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="adjust-tile")
+            self._pool_threads = self.num_threads
+        return self._pool
+
+    def run(self, image, stages, cancelled=None, keep=None):
+        """Applies stages, a list of (function, halo), and returns a list with one entry per stage.
+
+        The entry of the last stage, and of every stage whose keep flag is
+        set, is a full-size output that every strip writes its own rows
+        into; the others are None. Returns None if cancelled() becomes true
+        before all strips are done.
+        """
+        height = image.shape[0]
+        rows = self.strip_rows(image)
+        last = len(stages) - 1
+        outputs = [np.empty_like(image) if i == last or (keep and keep[i]) else None for i in range(len(stages))]
+        total_halo = sum(halo for _, halo in stages)
+
+        def run_strip(y0):
+            if cancelled is not None and cancelled():
+                return False
+            y1 = min(height, y0 + rows)
+            margin = total_halo
+            top, bottom = max(0, y0 - margin), min(height, y1 + margin)
+            block = image[top:bottom]
+            for (function, halo), output in zip(stages, outputs):
+                if top == y0 and bottom == y1:
+                    # No halo rows left to carry: write straight into the output, if the stage has one
+                    block = function(block, output[y0:y1] if output is not None else None)
+                    continue
+                result = function(block)
+                if output is not None:
+                    output[y0:y1] = result[y0 - top:y1 - top]
+                # Rows within the consumed halo are no longer trustworthy, drop them
+                margin -= halo
+                new_top, new_bottom = max(0, y0 - margin), min(height, y1 + margin)
+                block = result[new_top - top:new_bottom - top]
+                top, bottom = new_top, new_bottom
+            return True
+
+        done = list(self._get_pool().map(run_strip, range(0, height, rows)))
+        return outputs if all(done) else None
+
 
 class ImageAdjustments:
-    def __init__(self):
+    def __init__(self, cache_budget_bytes=DEFAULT_CACHE_BUDGET, tile_rows=None, num_threads=None):
+        self.reset()
+        # Lookup tables keyed by name, rebuilt only when their parameters change
+        self._table_cache = {}
+        # Intermediate stage outputs, so moving a late slider resumes mid-chain
+        self.stage_cache = StageCache(cache_budget_bytes)
+        # Large images run the chain strip by strip across threads
+        self.executor = TiledExecutor(tile_rows, num_threads)
+        self.min_tiled_pixels = MIN_TILED_PIXELS
+
+    def reset(self):
+        """Resets all adjustments to their default values."""
         self.brightness = 0
         self.contrast = 0
         self.saturation = 0
@@ -13,83 +161,284 @@ class ImageAdjustments:
         self.sharpness = 0
         self.gamma = 1.0
 
-    def reset(self):
-        """Resets all adjustments to their default values."""
-        self.__init__()
+    def invalidate_cache(self):
+        """Drops cached stage outputs, e.g. when the source image is replaced."""
+        self.stage_cache.clear()
+
+    def snapshot(self):
+        """Returns a copy of the current parameters that is safe to apply off the GUI thread.
+
+        The copy shares the lookup table and stage caches; table entries are
+        replaced whole and checked against their key, and StageCache is locked.
+        """
+        return copy.copy(self)
+
+    @staticmethod
+    def _linear_table(alpha, beta):
+        """Returns the table equivalent of cv2.addWeighted(image, alpha, image, 0, beta)."""
+        # addWeighted works in float32 and rounds half to even; match it exactly
+        values = np.arange(256, dtype=np.float32) * np.float32(alpha) + np.float32(beta)
+        return np.clip(np.rint(values), 0, 255).astype(np.uint8)
+
+    def _brightness_table(self):
+        """Returns the brightness lookup table, or None when brightness is neutral."""
+        if self.brightness == 0:
+            return None
+        if self.brightness > 0:
+            shadow = self.brightness
+            highlight = 255
+        else:
+            shadow = 0
+            highlight = 255 + self.brightness
+        return self._linear_table((highlight - shadow) / 255, shadow)
+
+    def _contrast_table(self):
+        """Returns the contrast lookup table, or None when contrast is neutral."""
+        if self.contrast == 0:
+            return None
+        f = 131 * (self.contrast + 127) / (127 * (131 - self.contrast))
+        return self._linear_table(f, 127 * (1 - f))
+
+    def _gamma_table(self):
+        """Returns the gamma lookup table, or None when gamma is neutral."""
+        if self.gamma == 1.0:
+            return None
+        inv_gamma = 1.0 / self.gamma
+        return np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
+
+    @staticmethod
+    def _compose_tables(*tables):
+        """Composes lookup tables in application order; None entries are identity."""
+        result = None
+        for table in tables:
+            if table is None:
+                continue
+            result = table if result is None else table[result]
+        return result
+
+    def _cached_table(self, name, key, build):
+        """Returns the cached table for name, rebuilding it when key changes."""
+        entry = self._table_cache.get(name)
+        if entry is None or entry[0] != key:
+            entry = (key, build())
+            self._table_cache[name] = entry
+        return entry[1]
+
+    def _point_tables(self):
+        """Returns the (pre, post) point-wise tables around the colour/sharpen stages.
+
+        Brightness and contrast run before saturation, hue and sharpness, gamma
+        runs after them. When those middle stages are neutral everything is
+        folded into the pre table and post is None. Tables are cached until a
+        parameter changes.
+        """
+        fused = not self._has_spatial_stages()
+
+        def build():
+            pre = self._compose_tables(self._brightness_table(), self._contrast_table())
+            post = self._gamma_table()
+            if fused:
+                return self._compose_tables(pre, post), None
+            return pre, post
+
+        return self._cached_table('point', (self.brightness, self.contrast, self.gamma, fused), build)
+
+    @staticmethod
+    def _hsv_table(saturation, hue):
+        """Returns a 3-channel HSV lookup table, or None when both values are neutral.
+
+        H is rotated and S is scaled exactly like the float32 path it replaces;
+        V passes through unchanged.
+        """
+        if saturation == 0 and hue == 0:
+            return None
+        levels = np.arange(256, dtype=np.float32)
+        h = ((levels + hue) % 180).astype(np.uint8)
+        s = np.clip(levels * (saturation / 100 + 1), 0, 255).astype(np.uint8)
+        v = np.arange(256, dtype=np.uint8)
+        return np.dstack([h, s, v])
+
+    def _apply_hsv(self, image, saturation, hue, dst=None):
+        """Scales S, then rotates H, each remapped in place in one HSV round-trip (the last into dst if given).
+
+        With both set this takes two round-trips, like applying the
+        saturation and hue sliders one after the other: the BGR rounding in
+        between moves the result by up to 2 levels if it is skipped.
+        """
+        tables = [self._cached_table('saturation', saturation, lambda: self._hsv_table(saturation, 0)),
+                  self._cached_table('hue', hue, lambda: self._hsv_table(0, hue))]
+        tables = [table for table in tables if table is not None]
+        for i, table in enumerate(tables):
+            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+            cv2.LUT(hsv, table, dst=hsv)
+            last = i == len(tables) - 1
+            image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=dst if last and dst is not None else hsv)
+        return image
+
+    @staticmethod
+    def _sharpen(image, amount, dst=None):
+        """Blends image with its 3x3 sharpened version (into dst if given)."""
+        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+        sharpened = cv2.filter2D(image, -1, kernel)
+        return cv2.addWeighted(image, 1 - amount, sharpened, amount, 0, dst=dst)
+
+    def _has_spatial_stages(self):
+        """Checks whether any stage that cannot be expressed as a lookup table is active."""
+        return self.saturation != 0 or self.hue != 0 or self.sharpness != 0
 
     def adjust_brightness(self, image):
         """Applies the brightness adjustment."""
-        if self.brightness != 0:
-            if self.brightness > 0:
-                shadow = self.brightness
-                highlight = 255
-            else:
-                shadow = 0
-                highlight = 255 + self.brightness
-            alpha_b = (highlight - shadow) / 255
-            gamma_b = shadow
-            return cv2.addWeighted(image, alpha_b, image, 0, gamma_b)
-        return image
+        table = self._brightness_table()
+        return cv2.LUT(image, table) if table is not None else image
 
     def adjust_contrast(self, image):
         """Applies the contrast adjustment."""
-        if self.contrast != 0:
-            f = 131 * (self.contrast + 127) / (127 * (131 - self.contrast))
-            alpha_c = f
-            gamma_c = 127 * (1 - f)
-            return cv2.addWeighted(image, alpha_c, image, 0, gamma_c)
-        return image
+        table = self._contrast_table()
+        return cv2.LUT(image, table) if table is not None else image
 
     def adjust_saturation(self, image):
         """Applies the saturation adjustment."""
-        if self.saturation != 0:
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            h, s, v = cv2.split(hsv)
-            s = s.astype(np.float32)
-            s = s * (self.saturation / 100 + 1)
-            s = np.clip(s, 0, 255).astype(np.uint8)
-            hsv = cv2.merge([h, s, v])
-            return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        return image
+        return self._apply_hsv(image, self.saturation, 0)
 
     def adjust_hue(self, image):
         """Applies the hue adjustment."""
-        if self.hue != 0:
-            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-            h, s, v = cv2.split(hsv)
-            h = h.astype(np.float32)
-            h = (h + self.hue) % 180
-            h = np.clip(h, 0, 180).astype(np.uint8)
-            hsv = cv2.merge([h, s, v])
-            return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        return image
+        return self._apply_hsv(image, 0, self.hue)
+
+    def adjust_hsv(self, image):
+        """Applies saturation and then hue, without going through the float32 path of each."""
+        return self._apply_hsv(image, self.saturation, self.hue)
 
     def adjust_sharpness(self, image):
         """Applies the sharpness adjustment."""
         if self.sharpness != 0:
-            kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
-            sharpened = cv2.filter2D(image, -1, kernel)
-            return cv2.addWeighted(image, 1 - self.sharpness, sharpened, self.sharpness, 0)
+            return self._sharpen(image, self.sharpness)
         return image
 
     def adjust_gamma(self, image):
         """Applies gamma correction."""
-        if self.gamma != 1.0:
-            inv_gamma = 1.0 / self.gamma
-            table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-            return cv2.LUT(image, table)
-        return image
+        table = self._gamma_table()
+        return cv2.LUT(image, table) if table is not None else image
 
-    def apply(self, image):
-        """Applies all adjustments sequentially."""
-        result = image.copy()
-        result = self.adjust_brightness(result)
-        result = self.adjust_contrast(result)
-        result = self.adjust_saturation(result)
-        result = self.adjust_hue(result)
-        result = self.adjust_sharpness(result)
-        result = self.adjust_gamma(result)
-        return result
+    def is_neutral(self):
+        """Returns True when every adjustment is at its default, so apply() leaves the image as it is."""
+        return not self._stages()
+
+    def _stages(self):
+        """Returns the active stages as (key, function, halo) in application order.
+
+        Neutral stages are left out. Brightness, contrast and gamma are applied
+        through cached lookup tables, folded into a single stage when saturation,
+        hue and sharpness are neutral. Functions take (image, dst=None); halo is
+        the number of neighbouring rows a stage reads on each side.
+        """
+        pre, post = self._point_tables()
+        saturation, hue, sharpness = self.saturation, self.hue, self.sharpness
+        stages = []
+        if pre is not None:
+            if post is None and not self._has_spatial_stages():
+                key = ('point', self.brightness, self.contrast, self.gamma)
+            else:
+                key = ('tone', self.brightness, self.contrast)
+            stages.append((key, lambda image, dst=None: cv2.LUT(image, pre, dst=dst), 0))
+        if saturation != 0 or hue != 0:
+            stages.append((('hsv', saturation, hue),
+                           lambda image, dst=None: self._apply_hsv(image, saturation, hue, dst), 0))
+        if sharpness != 0:
+            stages.append((('sharpen', sharpness),
+                           lambda image, dst=None: self._sharpen(image, sharpness, dst), 1))
+        if post is not None:
+            stages.append((('gamma', self.gamma), lambda image, dst=None: cv2.LUT(image, post, dst=dst), 0))
+        return stages
+
+    def apply(self, image, cancelled=None):
+        """Applies all adjustments sequentially.
+
+        Stage outputs are cached under the source identity and the parameters
+        of that stage and all earlier ones, so the chain resumes from the deepest
+        cached intermediate. Only as many of the last outputs as the cache
+        budget holds are kept at full size (see _stages_to_keep). The result may be shared with the cache, or be
+        image itself when every adjustment is neutral, and is read-only; copy
+        it before editing in place.
+
+        Images of at least min_tiled_pixels run through the tiled executor.
+        cancelled is an optional callable polled between strips (or stages);
+        when it returns True, apply gives up and returns None.
+        """
+        stages = self._stages()
+        if not stages:
+            return image
+        keys = [tuple(stage[0] for stage in stages[:i + 1]) for i in range(len(stages))]
+
+        result, start = image, 0
+        for i in range(len(stages) - 1, -1, -1):
+            cached = self.stage_cache.get(image, keys[i])
+            if cached is not None:
+                result, start = cached, i + 1
+                break
+        if start == len(stages):
+            return result
+
+        remaining = stages[start:]
+        keep = self._stages_to_keep(result, len(remaining))
+        if image.shape[0] * image.shape[1] >= self.min_tiled_pixels:
+            outputs = self.executor.run(result, [(function, halo) for _, function, halo in remaining], cancelled,
+                                        keep)
+            if outputs is None:
+                return None
+        else:
+            outputs = []
+            for (_, function, _), kept in zip(remaining, keep):
+                if cancelled is not None and cancelled():
+                    return None
+                result = function(result)
+                outputs.append(result if kept else None)
+        for key, output in zip(keys[start:], outputs):
+            if output is not None:
+                self.stage_cache.put(image, key, output)
+        return outputs[-1]
+
+    def _stages_to_keep(self, image, count):
+        """Returns which of count stage outputs to keep at full size: the last ones, as many as the cache holds.
+
+        The last output is always kept since it is the result. The outputs
+        right before it come next, as they let a late slider resume closest
+        to the end of the chain.
+        """
+        fits = max(1, self.stage_cache.budget_bytes // max(1, image.nbytes))
+        return [i >= count - fits for i in range(count)]
+
+    def apply_region(self, image, x, y, width, height, cancelled=None):
+        """Applies all adjustments to one rectangle of image.
+
+        The rectangle is read together with the stage halo around it, so the
+        result matches the same pixels of apply(image). Its columns are also
+        snapped to the REGION_ALIGN grid: OpenCV's vectorised HSV conversion
+        rounds differently in the scalar tail of each row. Cached full-size
+        intermediates are reused as the starting point, but nothing computed
+        here is cached. Returns None if cancelled() turns True between stages.
+        """
+        stages = self._stages()
+        source = image
+        for i in range(len(stages), 0, -1):
+            cached = self.stage_cache.get(image, tuple(stage[0] for stage in stages[:i]))
+            if cached is not None:
+                source, stages = cached, stages[i:]
+                break
+        if not stages:
+            return source[y:y + height, x:x + width].copy()
+
+        halo = sum(stage[2] for stage in stages)
+        top, left = max(0, y - halo), max(0, x - halo)
+        bottom = min(source.shape[0], y + height + halo)
+        right = min(source.shape[1], x + width + halo)
+        left -= left % REGION_ALIGN
+        right = min(source.shape[1], right + -right % REGION_ALIGN)
+        block = source[top:bottom, left:right]
+        for _, function, _ in stages:
+            if cancelled is not None and cancelled():
+                return None
+            block = function(block)
+        return block[y - top:y - top + height, x - left:x - left + width]
 
     def update_brightness(self, value):
         """Updates the brightness value."""
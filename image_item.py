@@ -0,0 +1,270 @@
+# image_item.py
+
+import math
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtCore import QRectF
+from PyQt5.QtGui import QImage, QPixmap, QColor
+from PyQt5.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+from image_pyramid import MipmapPyramid
+from out_of_core import scratch_array
+
+
+class ImageItem(QGraphicsItem):
+    """Scene item that shows a numpy image of any size as lazily uploaded tiles.
+
+    The pixels live in a persistent BGRA numpy buffer, which on little-endian
+    machines has the byte order of QImage.Format_RGB32. set_image() converts
+    into it in place and only reallocates when the size changes. Nothing
+    wraps the whole buffer, so images beyond Qt's 2 GB QImage and 32767 px
+    QPixmap limits work too.
+
+    Painting splits the exposed area into TILE_SIZE tiles. Each tile is
+    wrapped in place by a QImage and uploaded to a QPixmap the first time it
+    is visible; at most MAX_CACHED_TILES, or twice the tiles the viewport
+    shows if that is more, stay cached, least recently drawn are evicted
+    first, and edits drop the tiles they touch. Below 50% zoom,
+    tiles come from the MipmapPyramid level that best matches the view scale.
+
+    With set_out_of_core(True) the buffer and the pyramid live in scratch
+    files, so only the tiles being uploaded have to be in RAM.
+    """
+    TILE_SIZE = 512
+    MAX_CACHED_TILES = 128  # About 128 MB of 512x512 RGB32 pixmaps, raised for viewports showing more
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # Fills option.exposedRect
+        self.buffer = None  # (height, width, 4) uint8 BGRA, alpha always 255
+        self._tiles = OrderedDict()  # (level, x, y) in level pixels -> QPixmap, least recently drawn first
+        self._tile_limit = self.MAX_CACHED_TILES
+        self._preview_buffer = None
+        self._preview_qimage = None  # Stretched over the item while a proxy preview is shown
+        self._patched = False  # True while write_regions() left the buffer out of step with the image
+        self.out_of_core = False
+        self._placeholder_size = (0, 0)  # Item size while set_placeholder() stands in for the buffer
+        self.pyramid = MipmapPyramid()
+        self.pyramid.levelsChanged.connect(self.update)
+
+    @staticmethod
+    def _wrap(buffer):
+        """Returns a QImage sharing memory with a BGRA array or row/column slice of one; keep the array alive."""
+        height, width = buffer.shape[:2]
+        # A voidptr selects the writable-memory constructor; a Python buffer would be
+        # treated as const and QPainter would silently paint on a detached copy
+        return QImage(sip.voidptr(buffer.ctypes.data), width, height, buffer.strides[0], QImage.Format_RGB32)
+
+    @staticmethod
+    def _write(image, dst):
+        """Converts a BGR or grayscale image into a BGRA view of a buffer."""
+        code = cv2.COLOR_GRAY2BGRA if image.ndim == 2 or image.shape[2] == 1 else cv2.COLOR_BGR2BGRA
+        result = cv2.cvtColor(image, code, dst=dst)
+        if not np.shares_memory(result, dst):
+            dst[...] = result  # OpenCV could not write through the view's strides
+
+    @staticmethod
+    def _allocate(buffer, height, width, out_of_core=False):
+        """Returns buffer, or a new one when it does not have the requested size or storage."""
+        if buffer is None or buffer.shape[:2] != (height, width) or isinstance(buffer, np.memmap) != out_of_core:
+            shape = (height, width, 4)
+            buffer = scratch_array(shape) if out_of_core else np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def set_out_of_core(self, out_of_core):
+        """Chooses whether the next set_image() keeps the buffer and pyramid in scratch files or in RAM."""
+        self.out_of_core = out_of_core
+        self.pyramid.out_of_core = out_of_core
+
+    def size(self):
+        """Returns (width, height) of the image, or of the placeholder when there is no buffer."""
+        if self.buffer is None:
+            return self._placeholder_size
+        return self.buffer.shape[1], self.buffer.shape[0]
+
+    def region_qimage(self, x, y, width, height):
+        """Returns a QImage sharing memory with one rect of the buffer, valid until the next set_image().
+
+        Painting on it edits the displayed pixels; call refresh_region() afterwards.
+        """
+        return self._wrap(self.buffer[y:y + height, x:x + width])
+
+    def pixel_color(self, x, y):
+        """Returns the displayed QColor at image pixel (x, y), or an invalid QColor outside the image."""
+        width, height = self.size()
+        if self.buffer is None or not (0 <= x < width and 0 <= y < height):
+            return QColor()
+        blue, green, red, _ = self.buffer[y, x]
+        return QColor(int(red), int(green), int(blue))
+
+    def has_preview(self):
+        return self._preview_qimage is not None
+
+    def set_image(self, image):
+        """Shows image at full resolution, dropping any preview."""
+        height, width = image.shape[:2]
+        buffer = self._allocate(self.buffer, height, width, self.out_of_core)
+        self._write(image, buffer)
+        if buffer is not self.buffer:
+            self.prepareGeometryChange()
+            self.buffer = buffer
+        self._preview_buffer = self._preview_qimage = None
+        self._patched = False
+        self.pyramid.set_source(self.buffer)
+        self._tiles.clear()
+        self.update()
+
+    def set_placeholder(self, preview, width, height):
+        """Drops the buffer and stretches preview over a width x height item until the next set_image()."""
+        self.prepareGeometryChange()
+        self.buffer = None
+        self._placeholder_size = (width, height)
+        self._patched = False
+        self.pyramid.set_source(None)
+        self._tiles.clear()
+        self.set_preview(preview)
+
+    def _clip(self, x, y, width, height):
+        """Returns the rect clipped to the item as (rows, columns) slices, or None if nothing is left."""
+        image_width, image_height = self.size()
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(image_width, x + width), min(image_height, y + height)
+        if right <= left or bottom <= top:
+            return None
+        return slice(top, bottom), slice(left, right)
+
+    def update_region(self, image, x, y, width, height):
+        """Copies one rect of image, which has the item's size, into the buffer and repaints only that area."""
+        if self.has_preview() or self._patched:
+            self.set_image(image)  # The rest of the buffer does not show image either
+            return
+        region = self._clip(x, y, width, height)
+        if region is None:
+            return
+        rows, columns = region
+        self._write(image[rows, columns], self.buffer[rows, columns])
+        self.refresh_region(columns.start, rows.start, columns.stop - columns.start, rows.stop - rows.start)
+
+    def refresh_region(self, x, y, width, height):
+        """Repaints a rect whose buffer pixels changed, e.g. after painting on region_qimage()."""
+        region = self._clip(x, y, width, height)
+        if region is None:
+            return
+        rows, columns = region
+        x, y, width, height = columns.start, rows.start, columns.stop - columns.start, rows.stop - rows.start
+        self.pyramid.update_region(x, y, width, height)
+        self._drop_tiles(x, y, width, height)
+        self.update(QRectF(x, y, width, height))
+
+    def _drop_tiles(self, x, y, width, height):
+        """Forgets the cached tiles of every level that show any pixel of a rect."""
+        size = self.TILE_SIZE
+        for level, tile_x, tile_y in list(self._tiles):
+            factor = 2 ** level
+            # Tiles include a one-pixel apron, and a changed pixel reaches the next 2x2 block per level
+            left, right = (tile_x - 1) * factor, (tile_x + size + 1) * factor
+            top, bottom = (tile_y - 1) * factor, (tile_y + size + 1) * factor
+            if left < x + width + factor and x - factor < right and top < y + height + factor and y - factor < bottom:
+                del self._tiles[level, tile_x, tile_y]
+
+    def read_region(self, image, x, y, width, height):
+        """Copies one rect of the displayed pixels into the BGR image of the item's size."""
+        region = self._clip(x, y, width, height)
+        if region is not None:
+            rows, columns = region
+            image[rows, columns] = cv2.cvtColor(self.buffer[rows, columns], cv2.COLOR_BGRA2BGR)
+
+    def set_preview(self, preview):
+        """Shows a downscaled rendering stretched over the item; the full-resolution buffer is kept."""
+        height, width = preview.shape[:2]
+        buffer = self._allocate(self._preview_buffer, height, width)
+        self._write(preview, buffer)
+        if buffer is not self._preview_buffer:
+            self._preview_buffer, self._preview_qimage = buffer, self._wrap(buffer)
+        self.update()
+
+    def write_regions(self, patches):
+        """Copies full-resolution (x, y, array) patches into the buffer and repaints just those areas."""
+        for x, y, patch in patches:
+            height, width = patch.shape[:2]
+            self._write(patch, self.buffer[y:y + height, x:x + width])
+            self.refresh_region(x, y, width, height)
+        self._patched = True
+
+    def to_array(self):
+        """Returns a BGR copy of the displayed full-resolution pixels, in a scratch file when out of core."""
+        if not self.out_of_core:
+            return cv2.cvtColor(self.buffer, cv2.COLOR_BGRA2BGR)
+        image = scratch_array(self.buffer.shape[:2] + (3,))
+        for top in range(0, image.shape[0], self.TILE_SIZE):
+            rows = slice(top, top + self.TILE_SIZE)
+            image[rows] = cv2.cvtColor(self.buffer[rows], cv2.COLOR_BGRA2BGR)
+        return image
+
+    def boundingRect(self):
+        width, height = self.size()
+        return QRectF(0, 0, width, height)
+
+    def paint(self, painter, option, widget=None):
+        if self._preview_qimage is not None:
+            painter.drawImage(self.boundingRect(), self._preview_qimage)
+            return
+        if self.buffer is None:
+            return
+        # exposedRect may be the whole item (e.g. QGraphicsScene.render), so also limit it to the device
+        transform, _ = painter.worldTransform().inverted()
+        device = transform.mapRect(QRectF(0, 0, painter.device().width(), painter.device().height()))
+        exposed = option.exposedRect.intersected(self.boundingRect()).intersected(device)
+        if painter.hasClipping():
+            exposed = exposed.intersected(painter.clipBoundingRect())
+        if exposed.isEmpty():
+            return
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        index, level = self.pyramid.level(self.pyramid.level_for_scale(scale))
+        factor = 2 ** index
+        image_width, image_height = self.size()
+        level_height, level_width = level.shape[:2]
+        size = self.TILE_SIZE
+        # Visible tiles must never evict each other, even where a repaint only exposes part of the device
+        visible = device.intersected(self.boundingRect())
+        columns = math.ceil(visible.width() / factor / size) + 1
+        rows = math.ceil(visible.height() / factor / size) + 1
+        self._tile_limit = max(self.MAX_CACHED_TILES, 2 * columns * rows)
+
+        left, top = int(exposed.left()) // factor, int(exposed.top()) // factor
+        right = min(level_width, math.ceil(exposed.right() / factor))
+        bottom = min(level_height, math.ceil(exposed.bottom() / factor))
+        for tile_y in range(top - top % size, bottom, size):
+            for tile_x in range(left - left % size, right, size):
+                pixmap, source = self._tile(index, level, tile_x, tile_y)
+                # Clip to the image: the last pixel of an odd-sized level stands for less than factor pixels
+                target = QRectF(tile_x * factor, tile_y * factor, source.width() * factor,
+                                source.height() * factor).intersected(self.boundingRect())
+                source.setWidth(target.width() / factor)
+                source.setHeight(target.height() / factor)
+                painter.drawPixmap(target, pixmap, source)
+
+    def _tile(self, index, level, tile_x, tile_y):
+        """Returns the cached or freshly uploaded pixmap of a tile, and the tile's rect within it.
+
+        Tiles carry a one-pixel apron of their neighbours so smooth scaling
+        does not show seams at tile edges.
+        """
+        size = self.TILE_SIZE
+        level_height, level_width = level.shape[:2]
+        left, top = max(0, tile_x - 1), max(0, tile_y - 1)
+        right, bottom = min(level_width, tile_x + size + 1), min(level_height, tile_y + size + 1)
+        source = QRectF(tile_x - left, tile_y - top,
+                        min(size, level_width - tile_x), min(size, level_height - tile_y))
+        key = (index, tile_x, tile_y)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap, source
+        pixmap = QPixmap.fromImage(self._wrap(level[top:bottom, left:right]))
+        self._tiles[key] = pixmap
+        while len(self._tiles) > self._tile_limit:
+            self._tiles.popitem(last=False)
+        return pixmap, source
@@ -0,0 +1,178 @@
+# image_loader.py
+
+import sys
+import traceback
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, QRect, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QImageIOHandler, QImageReader
+from PyQt5.QtWidgets import QApplication
+from debug_types import DebugLevel
+from image_operations import ImageOperations
+from out_of_core import scratch_array
+
+DECODE_STRIP_BYTES = 256 * 2 ** 20  # Decoded size of one strip in decode_in_strips()
+
+
+def decode_in_strips(filename, width, height):
+    """Decodes filename strip by strip into a scratch-file-backed numpy.memmap, or returns None if it cannot.
+
+    Uses QImageReader clip rects, which only the JPEG plugin decodes
+    without the whole image in RAM. Each strip decodes the file from the
+    top down to its last row, so n strips take about n / 2 full decodes:
+    the price of opening out of core where OpenCV cannot decode into an
+    existing array (see ImageOperations.IMREAD_INTO). Files with an EXIF
+    orientation are left to OpenCV, which applies it while Qt does not.
+    """
+    reader = QImageReader(filename)
+    if not reader.supportsOption(QImageIOHandler.ClipRect) \
+            or reader.transformation() != QImageIOHandler.TransformationNone:
+        return None
+    image = scratch_array((height, width, 3))
+    rows = max(1, DECODE_STRIP_BYTES // (width * 4))
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        reader = QImageReader(filename)
+        reader.setClipRect(QRect(0, top, width, bottom - top))
+        strip = reader.read()
+        if strip.isNull() or (strip.width(), strip.height()) != (width, bottom - top):
+            return None
+        strip = strip.convertToFormat(QImage.Format_RGB32)  # B, G, R, 255 in memory on little-endian machines
+        pixels = np.frombuffer(strip.constBits().asarray(strip.byteCount()), np.uint8)
+        pixels = pixels.reshape(bottom - top, strip.bytesPerLine() // 4, 4)[:, :width]
+        if sys.byteorder == 'little':
+            image[top:bottom] = pixels[..., :3]
+        else:
+            image[top:bottom] = pixels[..., 3:0:-1]
+    return image
+
+
+class ImageLoadJobSignals(QObject):
+    finished = pyqtSignal(int)  # generation; the image or error is kept on the job
+
+
+class ImageLoadJob(QRunnable):
+    """Decodes an image file at full resolution on a worker thread."""
+
+    def __init__(self, generation, filename, width, height, out_of_core):
+        super().__init__()
+        self.generation = generation
+        self.filename = filename
+        self.width = width
+        self.height = height
+        self.out_of_core = out_of_core
+        self.image = None  # Results stay on the job so ImageLoader.wait() can pick them up
+        self.error = None
+        self.fallback = None  # Why an out-of-core image was decoded in RAM first
+        self.signals = ImageLoadJobSignals()
+
+    def run(self):
+        try:
+            if self.out_of_core:
+                self.image = None
+                if not ImageOperations.IMREAD_INTO:
+                    self.image = decode_in_strips(self.filename, self.width, self.height)
+                if self.image is None:
+                    self.image, self.fallback = ImageOperations.open_image_mapped(self.filename, self.width,
+                                                                                  self.height)
+            else:
+                self.image = ImageOperations.open_image(self.filename)
+        except Exception as e:
+            self.error = f"{e}\n{traceback.format_exc()}"
+        self.signals.finished.emit(self.generation)
+
+
+class ImageLoader(QObject):
+    """Opens image files, decoding large ones in the background.
+
+    Files above BACKGROUND_PIXELS are decoded on a worker thread. JPEGs are
+    first decoded with IMREAD_REDUCED_COLOR_2/4/8, which libjpeg does by
+    scaling the DCT at a fraction of the cost of a full decode, and that
+    preview is stretched over the image rect at once. Other formats keep
+    showing the previous image until theirs is ready.
+
+    There is nothing to edit until the full image arrives: anything that
+    needs the real pixels calls wait() first (via commit_adjustments), which
+    blocks until the load is done. Images that decode to more than
+    OUT_OF_CORE_BYTES are opened into a scratch file (see out_of_core.py):
+    decoded straight into it with OpenCV 4.11 or newer, strip by strip for
+    JPEGs on older versions, and otherwise decoded in RAM and then moved
+    there, which is logged.
+    """
+    BACKGROUND_PIXELS = 12_000_000  # Smaller files decode fast enough to open directly
+    PREVIEW_SIZE = 2048  # Longest side the reduced decode aims for
+    REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    OUT_OF_CORE_BYTES = 1024 ** 3
+
+    def __init__(self, main_window):
+        super().__init__(main_window)
+        self.mw = main_window
+        self.generation = 0
+        self._job = None  # Background load whose result has not been shown yet
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def open(self, filename):
+        """Opens filename, directly or with a preview and a background decode depending on its size."""
+        self.cancel()
+        mw = self.mw
+        # The header alone tells the decoded size without decoding
+        reader = QImageReader(filename)
+        size = reader.size()
+        width, height = size.width(), size.height()
+        out_of_core = size.isValid() and width * height * 3 > self.OUT_OF_CORE_BYTES
+        if out_of_core:
+            mw.show_debug_info(f"Opening {width}x{height} image out of core", DebugLevel.INFO)
+
+        if not size.isValid() or width * height <= self.BACKGROUND_PIXELS:
+            mw.event_handlers.show_opened_image(filename, ImageOperations.open_image(filename))
+            return
+
+        if bytes(reader.format()) == b'jpeg':
+            factor = next((factor for factor in sorted(self.REDUCED_FLAGS)
+                           if max(width, height) / factor <= self.PREVIEW_SIZE), max(self.REDUCED_FLAGS))
+            preview = cv2.imread(filename, self.REDUCED_FLAGS[factor])
+            if preview is not None:
+                mw.view.show_placeholder(preview, width, height)
+                mw.show_debug_info(f"Showing 1/{factor} preview of {filename}", DebugLevel.DEBUG)
+
+        self._job = ImageLoadJob(self.generation, filename, width, height, out_of_core)
+        self._job.signals.finished.connect(self._on_job_finished)
+        self.pool.start(self._job)
+        mw.statusBar().showMessage(f'Loading {filename}...')
+        mw.show_debug_info(f"Decoding {width}x{height} image in the background: {filename}", DebugLevel.INFO)
+
+    def wait(self):
+        """Blocks until a background load has finished and its image is shown."""
+        job = self._job
+        if job is None:
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.pool.waitForDone()
+        finally:
+            QApplication.restoreOverrideCursor()
+        self._finish(job)
+
+    def cancel(self):
+        """Forgets a background load; its result is dropped when it arrives."""
+        self.generation += 1
+        self._job = None
+
+    def _on_job_finished(self, generation):
+        job = self._job
+        if job is None or job.generation != generation:
+            self.mw.show_debug_info(f"Dropped stale image load (generation {generation})", DebugLevel.DEBUG)
+            return
+        self._finish(job)
+
+    def _finish(self, job):
+        self._job = None
+        if job.error is not None:
+            self.mw.show_debug_info(f"Error opening image: {job.error}", DebugLevel.ERROR)
+        if job.fallback is not None:
+            self.mw.show_debug_info(f"Decoded {job.filename} in RAM before moving it out of core: {job.fallback}",
+                                    DebugLevel.WARNING)
+        self.mw.event_handlers.show_opened_image(job.filename, job.image, job.out_of_core)
@@ -2,6 +2,10 @@
 
 import cv2
 import numpy as np
+from out_of_core import scratch_array, scratch_copy
+
+DEFAULT_PNG_COMPRESSION = 1  # OpenCV's own default
+DEFAULT_JPEG_QUALITY = 95  # OpenCV's own default
 
 
 class ImageOperations:
@@ -10,10 +14,50 @@ class ImageOperations:
         """Opens an image from a file."""
         return cv2.imread(filename)
 
+    # imread(filename, dst, flags), which decodes into an existing array, is new in OpenCV 4.11
+    IMREAD_INTO = tuple(int(part) for part in cv2.__version__.split('.')[:2]) >= (4, 11)
+
+    @staticmethod
+    def open_image_mapped(filename, width, height, directory=None):
+        """Opens an image into a scratch-file-backed numpy.memmap instead of RAM.
+
+        width and height come from the file header and let OpenCV decode
+        straight into the mapping. Returns (image, fallback): image is None
+        if the file cannot be read, and fallback says why the image had to
+        be decoded in RAM first, or is None if it was not.
+        """
+        if not cv2.haveImageReader(filename):
+            return None, None
+        if ImageOperations.IMREAD_INTO:
+            image = scratch_array((height, width, 3), directory=directory)
+            try:
+                cv2.imread(filename, image, cv2.IMREAD_COLOR)
+                return image, None
+            except (cv2.error, TypeError) as e:
+                # The decoded size differs from the header's, e.g. after EXIF rotation
+                fallback = f"decoding into the scratch file raised {type(e).__name__}"
+        else:
+            fallback = f"OpenCV {cv2.__version__} cannot decode into an existing array"
+        decoded = cv2.imread(filename)
+        return (scratch_copy(decoded, directory) if decoded is not None else None), fallback
+
+    @staticmethod
+    def save_image(filename, image, params=None):
+        """Saves the image to a file; params come from encode_params()."""
+        return cv2.imwrite(filename, image, params or [])
+
     @staticmethod
-    def save_image(filename, image):
-        """Saves the image to a file."""
-        cv2.imwrite(filename, image)
+    def encode_params(extension, png_compression=DEFAULT_PNG_COMPRESSION, jpeg_quality=DEFAULT_JPEG_QUALITY,
+                      jpeg_progressive=False, jpeg_optimize=False):
+        """Returns the cv2.imwrite/imencode parameter list for a file extension and encoder options."""
+        extension = extension.lower()
+        if extension == '.png':
+            return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        if extension in ('.jpg', '.jpeg'):
+            return [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality,
+                    cv2.IMWRITE_JPEG_PROGRESSIVE, int(jpeg_progressive),
+                    cv2.IMWRITE_JPEG_OPTIMIZE, int(jpeg_optimize)]
+        return []
 
     @staticmethod
     def create_new_image(width, height, color=(255, 255, 255)):
@@ -0,0 +1,164 @@
+# image_pyramid.py
+
+import math
+import traceback
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from debug_types import DebugLevel
+from out_of_core import scratch_array
+
+STRIP_ROWS = 1024  # Even, so strips split the image along 2x2 blocks
+
+
+def half_shape(shape):
+    """Returns the shape of an array after downsample()."""
+    return ((shape[0] + 1) // 2, (shape[1] + 1) // 2) + tuple(shape[2:])
+
+
+def downsample(image, dst=None):
+    """Halves an image with a 2x2 box filter; odd sizes round up by repeating the last row or column.
+
+    Works a strip of rows at a time, writing into dst if given, so a memmap
+    source never has to be resident all at once.
+    """
+    if dst is None:
+        dst = np.empty(half_shape(image.shape), dtype=image.dtype)
+    for top in range(0, image.shape[0], STRIP_ROWS):
+        strip = image[top:top + STRIP_ROWS]
+        rows, columns = strip.shape[:2]
+        if rows % 2 or columns % 2:
+            strip = cv2.copyMakeBorder(strip, 0, rows % 2, 0, columns % 2, cv2.BORDER_REPLICATE)
+        half = cv2.resize(strip, (strip.shape[1] // 2, strip.shape[0] // 2), interpolation=cv2.INTER_AREA)
+        dst[top // 2:top // 2 + half.shape[0]] = half
+    return dst
+
+
+class PyramidJobSignals(QObject):
+    finished = pyqtSignal(int, int, object)  # generation, first level, list of arrays
+    failed = pyqtSignal(int, str)
+
+
+class PyramidJob(QRunnable):
+    """Builds levels first_level..last_level of a pyramid from the level just above them."""
+
+    def __init__(self, generation, source, first_level, last_level, out_of_core=False):
+        super().__init__()
+        self.generation = generation
+        self.source = source
+        self.first_level = first_level
+        self.last_level = last_level
+        self.out_of_core = out_of_core  # Write the levels to scratch files instead of RAM
+        self.signals = PyramidJobSignals()
+
+    def run(self):
+        try:
+            levels = []
+            image = self.source
+            for _ in range(self.first_level, self.last_level + 1):
+                dst = scratch_array(half_shape(image.shape), image.dtype) if self.out_of_core else None
+                image = downsample(image, dst)
+                levels.append(image)
+            self.signals.finished.emit(self.generation, self.first_level, levels)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, f"{e}\n{traceback.format_exc()}")
+
+
+class MipmapPyramid(QObject):
+    """Half, quarter, eighth... reductions of an image, built on demand on a worker thread.
+
+    Level 0 is the source itself and level k is downscaled by 2**k. Asking for
+    a level that is not built yet returns the closest finer one and queues
+    the build; levelsChanged fires once it is ready. Edits to the source are
+    either applied to the built levels region by region (update_region) or
+    drop them all (set_source). Every change bumps the generation so a build
+    started from older pixels is thrown away.
+    """
+    MIN_SIZE = 64  # No level is made whose longer side would drop below this
+    levelsChanged = pyqtSignal()
+    debugInfo = pyqtSignal(str, DebugLevel)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.source = None
+        self.levels = []  # levels[k - 1] is level k
+        self.generation = 0
+        self._target = 0  # Deepest level asked for
+        self._building = False
+        self.out_of_core = False  # Build levels into scratch files
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def max_level(self):
+        if self.source is None:
+            return 0
+        longest = max(self.source.shape[:2])
+        return max(0, int(math.log2(longest / self.MIN_SIZE))) if longest > self.MIN_SIZE else 0
+
+    def level_for_scale(self, scale):
+        """Returns the coarsest level that still has at least one pixel per device pixel at scale."""
+        if scale <= 0 or scale >= 1:
+            return 0
+        return min(self.max_level(), int(math.floor(math.log2(1 / scale))))
+
+    def set_source(self, source):
+        """Uses a new source image; every built level is dropped."""
+        self.source = source
+        self.generation += 1
+        self.levels = []
+        self._target = 0
+
+    def update_region(self, x, y, width, height):
+        """Rebuilds the part of every built level covering a changed rect of the source."""
+        self.generation += 1
+        left, top, right, bottom = x, y, x + width, y + height
+        above = self.source
+        for level in self.levels:
+            # Snap to whole 2x2 blocks so the result matches a full rebuild exactly
+            left, top = left - left % 2, top - top % 2
+            right, bottom = min(above.shape[1], right + right % 2), min(above.shape[0], bottom + bottom % 2)
+            if right <= left or bottom <= top:
+                break
+            block = downsample(above[top:bottom, left:right])
+            left, top, right, bottom = left // 2, top // 2, (right + 1) // 2, (bottom + 1) // 2
+            level[top:bottom, left:right] = block
+            above = level
+
+    def level(self, index):
+        """Returns (k, array) for the built level closest to index from the fine side, queuing the rest."""
+        index = min(index, self.max_level())
+        if index > len(self.levels):
+            self._request(index)
+            index = len(self.levels)
+        return index, (self.levels[index - 1] if index else self.source)
+
+    def _request(self, index):
+        self._target = max(self._target, index)
+        if self._building or self.source is None or self._target <= len(self.levels):
+            return
+        self._building = True
+        first = len(self.levels) + 1
+        source = self.levels[-1] if self.levels else self.source
+        job = PyramidJob(self.generation, source, first, self._target, self.out_of_core)
+        job.signals.finished.connect(self._on_job_finished)
+        job.signals.failed.connect(self._on_job_failed)
+        self.pool.start(job)
+
+    def _on_job_finished(self, generation, first_level, levels):
+        self._building = False
+        if generation != self.generation or first_level != len(self.levels) + 1:
+            # Built from pixels that changed since; start over from what is current
+            self.debugInfo.emit(f"Dropped stale pyramid levels {first_level}-{first_level + len(levels) - 1}",
+                                DebugLevel.DEBUG)
+            self._request(self._target)
+            return
+        self.levels.extend(levels)
+        self.debugInfo.emit(f"Pyramid levels {first_level}-{len(self.levels)} built", DebugLevel.DEBUG)
+        self._request(self._target)
+        self.levelsChanged.emit()
+
+    def _on_job_failed(self, generation, message):
+        self._building = False
+        self.debugInfo.emit(f"Error building pyramid: {message}", DebugLevel.ERROR)
@@ -0,0 +1,182 @@
+# image_saver.py
+
+import os
+import time
+import traceback
+
+import cv2
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtWidgets import QDialog, QFormLayout, QSpinBox, QCheckBox, QDialogButtonBox, QLabel, QMessageBox
+from debug_types import DebugLevel
+from image_operations import ImageOperations, DEFAULT_PNG_COMPRESSION, DEFAULT_JPEG_QUALITY
+
+
+class SaveOptionsDialog(QDialog):
+    """Asks for the encoder options of one format, starting from the last ones used."""
+
+    def __init__(self, extension, options, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Save Options")
+        layout = QFormLayout(self)
+
+        self.png_compression = QSpinBox()
+        self.png_compression.setRange(0, 9)
+        self.png_compression.setValue(options['png_compression'])
+        self.png_compression.setToolTip("0 is fastest and largest, 9 is slowest and smallest")
+
+        self.jpeg_quality = QSpinBox()
+        self.jpeg_quality.setRange(0, 100)
+        self.jpeg_quality.setValue(options['jpeg_quality'])
+        self.jpeg_progressive = QCheckBox("Progressive")
+        self.jpeg_progressive.setChecked(options['jpeg_progressive'])
+        self.jpeg_optimize = QCheckBox("Optimized Huffman tables")
+        self.jpeg_optimize.setChecked(options['jpeg_optimize'])
+
+        if extension == '.png':
+            layout.addRow(QLabel("Compression level:"), self.png_compression)
+        else:
+            layout.addRow(QLabel("Quality:"), self.jpeg_quality)
+            layout.addRow(self.jpeg_progressive)
+            layout.addRow(self.jpeg_optimize)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+
+    def options(self):
+        return {
+            'png_compression': self.png_compression.value(),
+            'jpeg_quality': self.jpeg_quality.value(),
+            'jpeg_progressive': self.jpeg_progressive.isChecked(),
+            'jpeg_optimize': self.jpeg_optimize.isChecked(),
+        }
+
+
+class ImageSaveJobSignals(QObject):
+    progress = pyqtSignal(str, int)  # filename, percent written; -1 while encoding
+    finished = pyqtSignal(str, float, int)  # filename, encode seconds, bytes written
+    failed = pyqtSignal(str, str)
+
+
+class ImageSaveJob(QRunnable):
+    """Encodes an image snapshot and writes it to a file on a worker thread.
+
+    The file is written next to its target and renamed over it at the end,
+    so a failed save never leaves half a file behind.
+    """
+    WRITE_CHUNK = 4 * 2 ** 20
+
+    def __init__(self, filename, image, params):
+        super().__init__()
+        self.filename = filename
+        self.image = image
+        self.params = params
+        self.signals = ImageSaveJobSignals()
+
+    def run(self):
+        partial = self.filename + '.part'
+        try:
+            self.signals.progress.emit(self.filename, -1)
+            start = time.perf_counter()
+            ok, encoded = cv2.imencode(os.path.splitext(self.filename)[1], self.image, self.params)
+            encode_time = time.perf_counter() - start
+            self.image = None  # The snapshot is no longer needed
+            if not ok:
+                raise ValueError("the encoder returned no data")
+
+            data = memoryview(encoded).cast('B')
+            with open(partial, 'wb') as f:
+                for offset in range(0, len(data), self.WRITE_CHUNK):
+                    f.write(data[offset:offset + self.WRITE_CHUNK])
+                    self.signals.progress.emit(self.filename, min(100, (offset + self.WRITE_CHUNK) * 100 // len(data)))
+            os.replace(partial, self.filename)
+            self.signals.finished.emit(self.filename, encode_time, len(data))
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            self.signals.failed.emit(self.filename, f"{e}\n{traceback.format_exc()}")
+
+
+class ImageSaver(QObject):
+    """Saves rendered images in the background with per-format encoder options.
+
+    Jobs are handed read-only pixels that nothing writes to afterwards, so
+    editing can go on while a large PNG encodes. Progress is shown in the status bar, and
+    encode time and output size are reported when each save finishes.
+    """
+    DEFAULT_OPTIONS = {
+        'png_compression': DEFAULT_PNG_COMPRESSION,
+        'jpeg_quality': DEFAULT_JPEG_QUALITY,
+        'jpeg_progressive': False,
+        'jpeg_optimize': False,
+    }
+
+    def __init__(self, main_window):
+        super().__init__(main_window)
+        self.mw = main_window
+        self.options = dict(self.DEFAULT_OPTIONS)  # Last options used, offered again next time
+        self._running = 0
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+
+    def ask_options(self, extension):
+        """Shows the options dialog for formats that have any; returns False if it was cancelled."""
+        if extension not in ('.png', '.jpg', '.jpeg'):
+            return True
+        dialog = SaveOptionsDialog(extension, self.options, self.mw)
+        if dialog.exec_() != QDialog.Accepted:
+            return False
+        self.options = dialog.options()
+        return True
+
+    def save(self, filename, image):
+        """Queues image, which must not change afterwards, to be encoded and written to filename."""
+        extension = os.path.splitext(filename)[1].lower()
+        params = ImageOperations.encode_params(extension, **self.options)
+        job = ImageSaveJob(filename, image, params)
+        job.signals.progress.connect(self._on_progress)
+        job.signals.finished.connect(self._on_finished)
+        job.signals.failed.connect(self._on_failed)
+        self._running += 1
+        self.pool.start(job)
+        self.mw.show_debug_info(f"Saving {filename} with {self._describe(extension)}", DebugLevel.INFO)
+
+    def _describe(self, extension):
+        options = self.options
+        if extension == '.png':
+            return f"compression {options['png_compression']}"
+        if extension in ('.jpg', '.jpeg'):
+            flags = [name for name, key in (('progressive', 'jpeg_progressive'), ('optimized', 'jpeg_optimize'))
+                     if options[key]]
+            return ', '.join([f"quality {options['jpeg_quality']}"] + flags)
+        return "default options"
+
+    def _on_progress(self, filename, percent):
+        progress = self.mw.save_progress
+        if progress is not None:
+            if percent < 0:
+                progress.setRange(0, 0)  # Encoders give no progress of their own
+            else:
+                progress.setRange(0, 100)
+                progress.setValue(percent)
+            progress.show()
+        self.mw.statusBar().showMessage(f'Encoding {filename}...' if percent < 0 else f'Writing {filename}...')
+
+    def _job_done(self):
+        self._running -= 1
+        if self._running == 0 and self.mw.save_progress is not None:
+            self.mw.save_progress.hide()
+
+    def _on_finished(self, filename, encode_time, size):
+        self._job_done()
+        self.mw.statusBar().showMessage(f'Saved {filename} ({size / 2 ** 20:.2f} MB, encoded in {encode_time:.2f} s)')
+        self.mw.show_debug_info(f"Image saved to {filename}: {size} bytes, encoded in {encode_time * 1000:.0f} ms",
+                                DebugLevel.INFO)
+
+    def _on_failed(self, filename, message):
+        self._job_done()
+        self.mw.statusBar().showMessage('Failed to save image')
+        self.mw.show_debug_info(f"Error saving image to {filename}: {message}", DebugLevel.ERROR)
+        QMessageBox.warning(self.mw, "Save Error", f"Could not save the image to {filename}.")
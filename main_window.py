@@ -7,6 +7,9 @@ from PyQt5.QtCore import Qt
 # Local imports
 from custom_graphics_view import CustomGraphicsView
 from image_adjustments import ImageAdjustments
+from adjustment_preview import AdjustmentPreview
+from image_loader import ImageLoader
+from image_saver import ImageSaver
 from vcolorpicker import useAlpha
 from debug_types import DebugLevel
 from debug_utils import DebugMessage, DebugWidget
@@ -31,6 +34,8 @@ class MainWindow(QMainWindow):
         self.brush_size_input = None
         self.brush_opacity_slider = None
         self.brush_opacity_input = None
+        self.brush_hardness_slider = None
+        self.brush_hardness_input = None
         self.penStyleComboBox = None
         self.penCapComboBox = None
         self.penJoinComboBox = None
@@ -84,6 +89,9 @@ class MainWindow(QMainWindow):
         self.view.set_debug_mode(self.debug_mode)
         self.setCentralWidget(self.view)
         self.adjustments = ImageAdjustments()
+        self.adjustment_preview = AdjustmentPreview(self)
+        self.image_loader = ImageLoader(self)
+        self.image_saver = ImageSaver(self)
         self.adjustment_sliders = {}
         self.current_color = QColor(Qt.black)
         self.current_color_2 = QColor(Qt.white)
@@ -175,6 +183,7 @@ class MainWindow(QMainWindow):
             self.debug_dock = QDockWidget("Debug Panel", self)
             self.debug_widget = DebugWidget() 
             self.debug_dock.setWidget(self.debug_widget)
+            self.debug_widget.set_history_usage(len(self.view.history), *self.view.history_usage())
             self.debug_dock.setMinimumHeight(150)
             self.debug_dock.setObjectName("DebugDockWidget") 
             self.debug_dock.setVisible(True)
@@ -184,6 +193,10 @@ class MainWindow(QMainWindow):
              self.debug_dock.setVisible(True)
              self.view.set_debug_mode(True)
 
+    def update_history_usage(self, entries, memory_bytes, disk_bytes):
+        if self.debug_widget:
+            self.debug_widget.set_history_usage(entries, memory_bytes, disk_bytes)
+
     def show_debug_info(self, info: str, level: DebugLevel = DebugLevel.INFO):
         if self.debug_mode and self.debug_widget:
             try:
@@ -197,6 +210,12 @@ class MainWindow(QMainWindow):
         self.view.zoomChanged.connect(self.event_handlers.update_zoom_status)
         self.view.colorPicked.connect(self.event_handlers.update_color_status)
         self.view.fontChanged.connect(self.event_handlers.update_font_status)
+        # The view asks for pending adjustment previews to be rendered before it edits pixels
+        self.view.imageCommitRequested.connect(self.event_handlers.commit_adjustments)
+        self.view.imageChanged.connect(self.adjustment_preview.clear)
+        self.view.viewportChanged.connect(self.adjustment_preview.update_viewport)
+        self.view.imageChanged.connect(self.adjustments.invalidate_cache)
+        self.view.historyUsageChanged.connect(self.update_history_usage)
         # Connect undo/redo state signals if needed elsewhere (e.g., to enable/disable actions)
         # self.view.undoStateChanged.connect(self.update_undo_action_state) 
         # self.view.redoStateChanged.connect(self.update_redo_action_state)
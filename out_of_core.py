@@ -0,0 +1,29 @@
+# out_of_core.py
+
+import tempfile
+
+import numpy as np
+
+STRIP_BYTES = 64 * 2 ** 20  # Copies between RAM and scratch files move this much at a time
+
+
+def scratch_array(shape, dtype=np.uint8, directory=None):
+    """Returns a zero-filled numpy.memmap backed by an anonymous temporary file.
+
+    Only the pages being read or written have to stay in RAM; the OS pages
+    the rest out to the file. The file is deleted when the array and every
+    view of it are gone.
+    """
+    with tempfile.TemporaryFile(prefix='pyqtshop-', suffix='.scratch', dir=directory) as file:
+        # The mapping keeps its own handle to the file, so closing ours is fine
+        return np.memmap(file, dtype=dtype, mode='w+', shape=tuple(shape))
+
+
+def scratch_copy(image, directory=None):
+    """Copies an array into a new scratch array, a strip of rows at a time."""
+    copy = scratch_array(image.shape, image.dtype, directory)
+    row_bytes = image[0].nbytes if image.shape[0] else 1
+    rows = max(1, STRIP_BYTES // max(1, row_bytes))
+    for top in range(0, image.shape[0], rows):
+        copy[top:top + rows] = image[top:top + rows]
+    return copy
@@ -0,0 +1,130 @@
+# stroke_input.py
+
+import math
+
+from PyQt5.QtCore import QObject, QPointF, QTimer
+
+
+class StrokeInput(QObject):
+    """Coalesces brush pointer input into at most one drawing pass per frame.
+
+    Mouse moves only append their viewport position to a buffer. Once per
+    FRAME_MS the buffer is mapped to image coordinates in one go, the
+    brush preview is moved to the newest position, and while a stroke is
+    in progress the positions are thinned to control points at least
+    CONTROL_SPACING viewport pixels apart. The stroke is drawn through
+    them in steps of about SPACING viewport pixels, along a Catmull-Rom
+    spline if smoothing is on. The drawing work per frame thus follows
+    the distance the pointer travelled, not how many events a 1000 Hz
+    mouse or tablet sent.
+    """
+    FRAME_MS = 16
+    CONTROL_SPACING = 6.0  # Viewport pixels between control points
+    SPACING = 2.0  # Viewport pixels between the points drawn along the spline
+
+    def __init__(self, view):
+        super().__init__(view)
+        self.view = view
+        self.smoothing = True
+        self._pending = []  # Viewport positions received since the last frame
+        self._controls = []  # Up to the last four control points in image coordinates
+        self._tail = None  # Newest image position, drawn to when the stroke ends
+        self._stroking = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(self.FRAME_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def move(self, viewport_pos):
+        """Buffers a pointer position; it is handled with the others at the next frame."""
+        self._pending.append(viewport_pos)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def begin(self, pos):
+        """Starts resampling a stroke that begins at image position pos."""
+        self.flush()  # Positions from before the press only move the preview
+        self._controls = [QPointF(pos)]
+        self._tail = None
+        self._stroking = True
+
+    def end(self):
+        """Draws all buffered input and the rest of the stroke up to the newest position."""
+        self.flush()
+        if self._stroking:
+            if self._tail is not None and self._tail != self._controls[-1]:
+                self._add_control(self._tail)
+            controls = self._controls  # Drawn up to the second to last point, if there are two or more
+            if len(controls) == 2:
+                self._draw_segment(controls[0], controls[0], controls[1], controls[1])
+            elif len(controls) == 3:
+                self._draw_segment(controls[0], controls[1], controls[2], controls[2])
+        self.cancel()
+
+    def cancel(self):
+        """Forgets the stroke and any buffered input without drawing it."""
+        self._timer.stop()
+        self._pending = []
+        self._controls = []
+        self._tail = None
+        self._stroking = False
+
+    def flush(self):
+        """Maps the buffered positions, moves the brush preview and draws what the stroke gained."""
+        self._timer.stop()
+        if not self._pending:
+            return
+        view = self.view
+        pending, self._pending = self._pending, []
+        to_scene = view.viewportTransform().inverted()[0]
+        view.update_brush_preview(to_scene.map(QPointF(pending[-1])))
+        if not self._stroking or view.pixmap_item is None:
+            return
+        to_image = to_scene * view.pixmap_item.sceneTransform().inverted()[0]
+        control_spacing = self.CONTROL_SPACING / self._zoom()
+        for viewport_pos in pending:
+            pos = to_image.map(QPointF(viewport_pos))
+            if view.shift_left_pressed and view.shift_start_point is not None:
+                pos = view.constrain_shift_line(pos)
+            self._tail = pos
+            if _distance(pos, self._controls[-1]) >= control_spacing:
+                self._add_control(pos)
+
+    def _zoom(self):
+        """Viewport pixels per image pixel."""
+        transform = self.view.transform()
+        return max(1e-6, math.hypot(transform.m11(), transform.m12()))
+
+    def _add_control(self, pos):
+        controls = self._controls
+        controls.append(pos)
+        if not self.smoothing:
+            self._draw_segment(controls[-2], controls[-2], pos, pos)
+            del controls[:-1]
+            return
+        # The curve into a control point depends on the one after it, so drawing lags one control point
+        if len(controls) == 3:
+            self._draw_segment(controls[0], controls[0], controls[1], controls[2])
+        elif len(controls) == 4:
+            self._draw_segment(controls[0], controls[1], controls[2], controls[3])
+            del controls[0]
+
+    def _draw_segment(self, p0, p1, p2, p3):
+        """Draws from p1 to p2, along the uniform Catmull-Rom spline through p0..p3 when smoothing."""
+        steps = max(1, math.ceil(_distance(p1, p2) * self._zoom() / self.SPACING)) if self.smoothing else 1
+        for step in range(1, steps + 1):
+            t = step / steps
+            self.view.draw_line_to(_catmull_rom(p0, p1, p2, p3, t) if step < steps else QPointF(p2))
+
+
+def _distance(a, b):
+    return math.hypot(b.x() - a.x(), b.y() - a.y())
+
+
+def _catmull_rom(p0, p1, p2, p3, t):
+    t2, t3 = t * t, t * t * t
+    return QPointF(
+        0.5 * (2 * p1.x() + (p2.x() - p0.x()) * t + (2 * p0.x() - 5 * p1.x() + 4 * p2.x() - p3.x()) * t2
+               + (3 * p1.x() - p0.x() - 3 * p2.x() + p3.x()) * t3),
+        0.5 * (2 * p1.y() + (p2.y() - p0.y()) * t + (2 * p0.y() - 5 * p1.y() + 4 * p2.y() - p3.y()) * t2
+               + (3 * p1.y() - p0.y() - 3 * p2.y() + p3.y()) * t3))
@@ -0,0 +1,225 @@
+# stroke_layer.py
+
+import math
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt5 import sip
+from PyQt5.QtCore import QRect, QRectF, QPointF
+from PyQt5.QtGui import QImage
+from PyQt5.QtWidgets import QGraphicsItem
+
+
+class BrushTip:
+    """Coverage masks of a round brush tip, cached per size, hardness, opacity and subpixel offset.
+
+    A mask is uint8 coverage (0-255) of one dab. Hardness 1 gives a hard,
+    antialiased edge; lower values fade out over the outer (1 - hardness)
+    of the radius. Dab centers are snapped to 1/SUBPIXEL of a pixel, so a
+    stroke needs at most SUBPIXEL ** 2 masks per brush setting.
+    """
+    SUBPIXEL = 4
+    MAX_CACHED_MASKS = 64
+
+    _masks = OrderedDict()  # Shared by all strokes, least recently used first
+
+    @classmethod
+    def mask(cls, size, hardness, opacity, phase_x=0, phase_y=0):
+        """Returns the mask of a dab whose center is (phase_x, phase_y) / SUBPIXEL right of and below
+        the center of its middle pixel; do not write to it."""
+        key = (size, hardness, opacity, phase_x, phase_y)
+        mask = cls._masks.get(key)
+        if mask is not None:
+            cls._masks.move_to_end(key)
+            return mask
+        radius = size / 2
+        half = math.ceil(radius) + 1  # One extra pixel for antialiasing and the subpixel offset
+        coordinates = np.arange(-half, half + 1, dtype=np.float32)
+        dy = coordinates[:, None] - phase_y / cls.SUBPIXEL
+        dx = coordinates[None, :] - phase_x / cls.SUBPIXEL
+        distance = np.sqrt(dx * dx + dy * dy)
+        alpha = np.clip(radius + 0.5 - distance, 0, 1)  # Antialiased edge
+        inner = radius * hardness
+        if inner < radius:
+            t = np.clip((distance - inner) / (radius - inner), 0, 1)
+            alpha *= 1 - t * t * (3 - 2 * t)  # Smoothstep falloff
+        mask = np.round(alpha * (opacity * 255)).astype(np.uint8)
+        mask.flags.writeable = False
+        cls._masks[key] = mask
+        while len(cls._masks) > cls.MAX_CACHED_MASKS:
+            cls._masks.popitem(last=False)
+        return mask
+
+
+class StrokeLayer(QGraphicsItem):
+    """Overlay item that collects one brush stroke as dabs in an off-screen raster buffer.
+
+    Dabs of a BrushTip are stamped every SPACING diameters along each
+    segment into uint8 coverage tiles of TILE_SIZE pixels, created only
+    where the stroke passes, keeping the larger coverage where dabs
+    overlap. The stroke therefore has one even opacity however often it
+    crosses itself, and a segment costs the same however long the stroke
+    already is. The tiles are shown through premultiplied BGRA copies,
+    redone when painted rather than per segment, and commit() alpha-blends
+    the coverage into an ImageItem's buffer with numpy.
+    """
+    TILE_SIZE = 256
+    SPACING = 0.1  # Distance between dabs as a fraction of the diameter
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)  # Fills option.exposedRect
+        self._coverage = {}  # (x, y) of the tile's top left image pixel -> (TILE_SIZE, TILE_SIZE) uint8
+        self._display = {}  # Same keys -> (BGRA premultiplied array, QImage wrapping it)
+        self._stale = set()  # Keys of display tiles behind their coverage, redone when next painted
+        self._bounds = QRectF()  # The image the stroke is drawn over
+        self._color = np.zeros(3, dtype=np.uint8)  # BGR
+        self._luts = None  # Coverage -> premultiplied B, G and R
+        self._size = 1
+        self._hardness = 1.0
+        self._opacity = 1.0
+        self._last_point = None  # Where the previous segment ended, None before the first dab
+        self._travelled = 0.0  # Distance along the stroke since the last dab
+        self.stroke_rect = QRect()  # Image pixels the stroke touched so far
+        self.active = False
+        self.hide()
+
+    def begin(self, color, size, hardness, width, height):
+        """Starts an empty stroke over a width x height image; the color's alpha is the brush opacity."""
+        if self._bounds != QRectF(0, 0, width, height):
+            self.prepareGeometryChange()
+            self._bounds = QRectF(0, 0, width, height)
+        self._coverage = {}
+        self._display = {}
+        self._stale = set()
+        self._color = np.array([color.blue(), color.green(), color.red()], dtype=np.uint8)
+        levels = np.arange(256, dtype=np.uint16)
+        self._luts = [((levels * int(channel) + 127) // 255).astype(np.uint8) for channel in self._color]
+        self._size = max(1, size)
+        self._hardness = hardness
+        self._opacity = color.alphaF()
+        self._last_point = None
+        self._travelled = 0.0
+        self.stroke_rect = QRect()
+        self.active = True
+        self.show()
+
+    def add_segment(self, start, end):
+        """Stamps dabs from start to end, the first one at start if the stroke has none yet, and repaints them."""
+        spacing = max(1.0, self._size * self.SPACING)
+        dx, dy = end.x() - start.x(), end.y() - start.y()
+        length = math.hypot(dx, dy)
+        first = 0.0 if self._last_point is None else spacing - self._travelled
+        distances = np.arange(first, length + 1e-6, spacing)
+        self._last_point = end
+        if not len(distances):
+            self._travelled += length
+            return
+        self._travelled = length - distances[-1]
+        rect = QRect()
+        for distance in distances:
+            t = distance / length if length else 0.0
+            rect = rect.united(self._stamp(start.x() + dx * t, start.y() + dy * t))
+        rect = rect.intersected(self._bounds.toAlignedRect())
+        if rect.isEmpty():
+            return
+        self._stale.update((tile_x, tile_y) for tile_x, tile_y, _, _ in self._tiles_in(rect))
+        self.stroke_rect = self.stroke_rect.united(rect)
+        self.update(QRectF(rect))
+
+    def _stamp(self, center_x, center_y):
+        """Adds one dab centered at image coordinates (center_x, center_y); returns the rect it covers."""
+        subpixel = BrushTip.SUBPIXEL
+        # Pixel (column, row) has its center at (column + 0.5, row + 0.5)
+        x, y = round((center_x - 0.5) * subpixel), round((center_y - 0.5) * subpixel)
+        mask = BrushTip.mask(self._size, self._hardness, self._opacity, x % subpixel, y % subpixel)
+        half = mask.shape[0] // 2
+        left, top = x // subpixel - half, y // subpixel - half
+        width, height = int(self._bounds.width()), int(self._bounds.height())
+        right, bottom = min(width, left + mask.shape[1]), min(height, top + mask.shape[0])
+        left_clipped, top_clipped = max(0, left), max(0, top)
+        if right <= left_clipped or bottom <= top_clipped:
+            return QRect()
+        size = self.TILE_SIZE
+        for tile_y in range(top_clipped - top_clipped % size, bottom, size):
+            for tile_x in range(left_clipped - left_clipped % size, right, size):
+                coverage = self._coverage.get((tile_x, tile_y))
+                if coverage is None:
+                    coverage = self._coverage[tile_x, tile_y] = np.zeros((size, size), dtype=np.uint8)
+                x0, y0 = max(left_clipped, tile_x), max(top_clipped, tile_y)
+                x1, y1 = min(right, tile_x + size), min(bottom, tile_y + size)
+                target = coverage[y0 - tile_y:y1 - tile_y, x0 - tile_x:x1 - tile_x]
+                np.maximum(target, mask[y0 - top:y1 - top, x0 - left:x1 - left], out=target)
+        return QRect(left_clipped, top_clipped, right - left_clipped, bottom - top_clipped)
+
+    def _tiles_in(self, rect):
+        """Yields (tile_x, tile_y, rows, columns) for the tiles overlapping rect, with the slices of the overlap."""
+        size = self.TILE_SIZE
+        left, top, right, bottom = rect.x(), rect.y(), rect.x() + rect.width(), rect.y() + rect.height()
+        for tile_y in range(top - top % size, bottom, size):
+            for tile_x in range(left - left % size, right, size):
+                if (tile_x, tile_y) in self._coverage:
+                    rows = slice(max(top, tile_y) - tile_y, min(bottom, tile_y + size) - tile_y)
+                    columns = slice(max(left, tile_x) - tile_x, min(right, tile_x + size) - tile_x)
+                    yield tile_x, tile_y, rows, columns
+
+    def _display_tile(self, key):
+        """Returns the QImage of a tile, first bringing it up to date with the coverage if needed."""
+        display = self._display.get(key)
+        if display is None:
+            size = self.TILE_SIZE
+            pixels = np.empty((size, size, 4), dtype=np.uint8)
+            image = QImage(sip.voidptr(pixels.ctypes.data), size, size, pixels.strides[0],
+                           QImage.Format_ARGB32_Premultiplied)
+            display = self._display[key] = (pixels, image)
+            self._stale.add(key)
+        if key in self._stale:
+            self._stale.discard(key)
+            pixels, coverage = display[0], self._coverage[key]
+            for channel, lut in enumerate(self._luts):
+                pixels[..., channel] = cv2.LUT(coverage, lut)
+            pixels[..., 3] = coverage
+        return display[1]
+
+    def commit(self, image_item):
+        """Alpha-blends the stroke into image_item's displayed pixels and clears it.
+
+        Returns the changed rect as (x, y, width, height), or None if the
+        stroke left no pixels.
+        """
+        rect = self.stroke_rect
+        changed = None
+        if self._coverage and not rect.isEmpty() and image_item.buffer is not None:
+            color = self._color.astype(np.uint16)
+            for tile_x, tile_y, rows, columns in self._tiles_in(rect):
+                coverage = self._coverage[tile_x, tile_y][rows, columns][..., None].astype(np.uint16)
+                target = image_item.buffer[tile_y + rows.start:tile_y + rows.stop,
+                                           tile_x + columns.start:tile_x + columns.stop, :3]
+                target[...] = (target * (255 - coverage) + color * coverage + 127) // 255
+            image_item.refresh_region(rect.x(), rect.y(), rect.width(), rect.height())
+            changed = (rect.x(), rect.y(), rect.width(), rect.height())
+        self.clear()
+        return changed
+
+    def clear(self):
+        """Drops the stroke without applying it."""
+        if not self.stroke_rect.isEmpty():
+            self.update(QRectF(self.stroke_rect))
+        self._coverage = {}
+        self._display = {}
+        self._stale = set()
+        self.stroke_rect = QRect()
+        self._last_point = None
+        self.active = False
+        self.hide()
+
+    def boundingRect(self):
+        return self._bounds
+
+    def paint(self, painter, option, widget=None):
+        size = self.TILE_SIZE
+        exposed = option.exposedRect
+        for tile_x, tile_y in self._coverage:
+            if exposed.intersects(QRectF(tile_x, tile_y, size, size)):
+                painter.drawImage(QPointF(tile_x, tile_y), self._display_tile((tile_x, tile_y)))
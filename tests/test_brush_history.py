@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from PyQt5.QtCore import QEvent, QPoint, QPointF, Qt
+from PyQt5.QtGui import QColor, QMouseEvent
+from PyQt5.QtWidgets import QApplication
+
+
+@pytest.fixture
+def view(qapp):
+    from custom_graphics_view import CustomGraphicsView
+    view = CustomGraphicsView()
+    view.resize(400, 300)
+    view.show()
+    view.set_image(np.full((200, 300, 3), 200, dtype=np.uint8), is_new_image=True)
+    view.set_tool('brush')
+    view.first_color = QColor(255, 0, 0)
+    view.brush_size = 6
+    view.resetTransform()
+    view.centerOn(150, 100)
+    yield view
+    view.close()
+
+
+def _send(view, kind, pos):
+    buttons = Qt.NoButton if kind == QEvent.MouseButtonRelease else Qt.LeftButton
+    event = QMouseEvent(kind, QPointF(view.mapFromScene(QPointF(pos))), Qt.LeftButton, buttons, Qt.NoModifier)
+    QApplication.sendEvent(view.viewport(), event)
+
+
+def _stroke(view, y):
+    """Drags the brush across the image along row y with real mouse events."""
+    _send(view, QEvent.MouseButtonPress, QPoint(20, y))
+    for x in range(22, 281, 2):
+        _send(view, QEvent.MouseMove, QPoint(x, y))
+    _send(view, QEvent.MouseButtonRelease, QPoint(280, y))
+
+
+def test_every_stroke_is_one_undo_step(view):
+    base = view.image.copy()
+    _stroke(view, 50)
+    after_a = view.image.copy()
+    _stroke(view, 150)
+    after_b = view.image.copy()
+    assert not np.array_equal(after_a, base)
+    assert not np.array_equal(after_b, after_a)
+
+    view.undo()
+    np.testing.assert_array_equal(view.image, after_a)
+    view.undo()
+    np.testing.assert_array_equal(view.image, base)
+    view.redo()
+    np.testing.assert_array_equal(view.image, after_a)
+    view.redo()
+    np.testing.assert_array_equal(view.image, after_b)
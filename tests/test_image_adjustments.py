@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+from image_adjustments import ImageAdjustments
+
+
+def _baseline_apply(image, brightness=0, contrast=0, saturation=0, hue=0, sharpness=0, gamma=1.0):
+    """The original per-slider implementation the table, HSV and tiled paths must reproduce."""
+    result = image.copy()
+    if brightness != 0:
+        shadow, highlight = (brightness, 255) if brightness > 0 else (0, 255 + brightness)
+        result = cv2.addWeighted(result, (highlight - shadow) / 255, result, 0, shadow)
+    if contrast != 0:
+        f = 131 * (contrast + 127) / (127 * (131 - contrast))
+        result = cv2.addWeighted(result, f, result, 0, 127 * (1 - f))
+    if saturation != 0:
+        h, s, v = cv2.split(cv2.cvtColor(result, cv2.COLOR_BGR2HSV))
+        s = np.clip(s.astype(np.float32) * (saturation / 100 + 1), 0, 255).astype(np.uint8)
+        result = cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR)
+    if hue != 0:
+        h, s, v = cv2.split(cv2.cvtColor(result, cv2.COLOR_BGR2HSV))
+        h = np.clip((h.astype(np.float32) + hue) % 180, 0, 180).astype(np.uint8)
+        result = cv2.cvtColor(cv2.merge([h, s, v]), cv2.COLOR_HSV2BGR)
+    if sharpness != 0:
+        kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]])
+        sharpened = cv2.filter2D(result, -1, kernel)
+        result = cv2.addWeighted(result, 1 - sharpness, sharpened, sharpness, 0)
+    if gamma != 1.0:
+        table = np.array([((i / 255.0) ** (1.0 / gamma)) * 255 for i in np.arange(0, 256)]).astype("uint8")
+        result = cv2.LUT(result, table)
+    return result
+
+
+@pytest.fixture(scope="module")
+def image():
+    rng = np.random.default_rng(7)
+    noise = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (5, 5), 0)  # Some smooth areas as well as edges
+
+
+SETTINGS = [
+    dict(brightness=40),
+    dict(contrast=-30, gamma=1.6),
+    dict(saturation=50),
+    dict(hue=-25),
+    dict(saturation=-40, hue=30),
+    dict(saturation=80, hue=100, sharpness=0.7),
+    dict(brightness=-20, contrast=25, saturation=35, hue=-60, sharpness=0.4, gamma=0.8),
+]
+
+
+@pytest.mark.parametrize("settings", SETTINGS)
+@pytest.mark.parametrize("tiled", [False, True])
+def test_apply_matches_baseline(image, settings, tiled):
+    adjustments = ImageAdjustments(tile_rows=64, num_threads=2)
+    adjustments.min_tiled_pixels = 0 if tiled else image.shape[0] * image.shape[1] + 1
+    for name, value in settings.items():
+        setattr(adjustments, name, value)
+    result = adjustments.apply(image)
+    difference = np.abs(result.astype(np.int16) - _baseline_apply(image, **settings).astype(np.int16))
+    assert difference.max() <= 1
+
+
+def test_tiled_apply_keeps_only_the_outputs_the_cache_holds(image):
+    settings = SETTINGS[-1]
+    adjustments = ImageAdjustments(cache_budget_bytes=2 * image.nbytes, tile_rows=64, num_threads=2)
+    adjustments.min_tiled_pixels = 0
+    for name, value in settings.items():
+        setattr(adjustments, name, value)
+    result = adjustments.apply(image)
+    assert len(adjustments._stages()) > 2
+    assert adjustments.stage_cache.size_bytes == 2 * image.nbytes
+    np.testing.assert_array_equal(result, _baseline_apply(image, **settings))
+    # Moving the last slider resumes from the kept output before it
+    adjustments.gamma = 1.2
+    np.testing.assert_array_equal(adjustments.apply(image), _baseline_apply(image, **dict(settings, gamma=1.2)))
@@ -0,0 +1,46 @@
+import cv2
+import numpy as np
+import pytest
+
+import image_loader
+from image_operations import ImageOperations
+
+
+@pytest.fixture
+def source():
+    rng = np.random.default_rng(3)
+    return cv2.GaussianBlur(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8), (7, 7), 0)
+
+
+def test_jpeg_decodes_in_strips_like_opencv(qapp, tmp_path, source, monkeypatch):
+    path = str(tmp_path / "image.jpg")
+    cv2.imwrite(path, source)
+    monkeypatch.setattr(image_loader, 'DECODE_STRIP_BYTES', 400 * 4 * 70)  # Five strips, the last one short
+    image = image_loader.decode_in_strips(path, 400, 300)
+    assert isinstance(image, np.memmap)
+    np.testing.assert_array_equal(image, cv2.imread(path))
+
+
+def test_formats_without_clip_rects_are_left_to_opencv(qapp, tmp_path, source):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, source)
+    assert image_loader.decode_in_strips(path, 400, 300) is None
+
+
+def test_fallback_decodes_in_ram_and_says_why(tmp_path, source, monkeypatch):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, source)
+    monkeypatch.setattr(ImageOperations, 'IMREAD_INTO', False)
+    image, fallback = ImageOperations.open_image_mapped(path, 400, 300)
+    assert isinstance(image, np.memmap)
+    np.testing.assert_array_equal(image, source)
+    assert fallback
+
+
+@pytest.mark.skipif(not ImageOperations.IMREAD_INTO, reason="OpenCV cannot decode into an existing array")
+def test_direct_decode_needs_no_fallback(tmp_path, source):
+    path = str(tmp_path / "image.png")
+    cv2.imwrite(path, source)
+    image, fallback = ImageOperations.open_image_mapped(path, 400, 300)
+    assert fallback is None
+    np.testing.assert_array_equal(image, source)
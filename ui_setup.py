@@ -1,7 +1,7 @@
 from PyQt5.QtWidgets import (QAction, QFileDialog, QLabel, QDockWidget, QVBoxLayout, 
                            QWidget, QSlider, QApplication, QMessageBox, QPushButton, 
                            QFontDialog, QHBoxLayout, QToolButton, QMenu, 
-                           QActionGroup, QLineEdit, QComboBox)
+                           QActionGroup, QLineEdit, QComboBox, QProgressBar)
 from PyQt5.QtGui import QIcon, QPixmap, QColor, QFont
 from PyQt5.QtCore import Qt
 
@@ -16,11 +16,14 @@ class UISetup:
         self.main_window.brush_size_input = None
         self.main_window.brush_opacity_slider = None
         self.main_window.brush_opacity_input = None
+        self.main_window.brush_hardness_slider = None
+        self.main_window.brush_hardness_input = None
         self.main_window.penStyleComboBox = None
         self.main_window.penCapComboBox = None
         self.main_window.penJoinComboBox = None
         self.main_window.brushStyleComboBox = None
         self.main_window.color_dock = None
+        self.main_window.save_progress = None
 
     def init_ui(self):
         mw = self.main_window 
@@ -38,9 +41,17 @@ class UISetup:
         self.create_adjustment_dock() # Connects sliders to event_handlers
         self.create_filters_dock()    # Connects buttons to event_handlers
         self.create_color_panel()     # Connects buttons/labels to event_handlers
+        self.create_status_bar()
         
         mw.statusBar().showMessage('Ready')
 
+    def create_status_bar(self):
+        mw = self.main_window
+        mw.save_progress = QProgressBar()
+        mw.save_progress.setMaximumWidth(150)
+        mw.save_progress.hide() # Shown by ImageSaver while a save runs
+        mw.statusBar().addPermanentWidget(mw.save_progress)
+
     def create_actions(self):
         mw = self.main_window
         eh = mw.event_handlers # Alias for event handlers
@@ -288,6 +299,7 @@ class UISetup:
         slider.setTickInterval(int((max_val - min_val) / 10))
         slider.valueChanged.connect(adjustment_slot) # Connect to ImageAdjustments update method
         slider.valueChanged.connect(apply_slot)      # Connect to EventHandlers apply_adjustments method
+        slider.sliderReleased.connect(mw.event_handlers.render_adjustments) # Full-resolution render on release
         layout.addWidget(slider)
         mw.adjustment_sliders[label] = slider 
 
@@ -370,6 +382,7 @@ class UISetup:
             mw.tools_toolbar = mw.addToolBar('Tools')
             self.add_brush_size_controls()
             self.add_brush_opacity_controls()
+            self.add_brush_hardness_controls()
             self.add_pen_style_controls()
             self.add_pen_cap_controls()
             self.add_pen_join_controls()
@@ -377,7 +390,7 @@ class UISetup:
         else:
             # Make sure controls are visible
             for w in [mw.brush_size_slider, mw.brush_size_input, mw.brush_opacity_slider,
-                      mw.brush_opacity_input, mw.penStyleComboBox, mw.penCapComboBox,
+                      mw.brush_opacity_input, mw.brush_hardness_slider, mw.brush_hardness_input, mw.penStyleComboBox, mw.penCapComboBox,
                       mw.penJoinComboBox, mw.brushStyleComboBox]:
                 if w: w.setVisible(True)
             mw.tools_toolbar.setVisible(True)
@@ -411,6 +424,20 @@ class UISetup:
         mw.brush_opacity_input.editingFinished.connect(eh.update_brush_opacity_from_input) # Connect to handler
         toolbar.addWidget(mw.brush_opacity_input)
 
+    def add_brush_hardness_controls(self):
+        mw = self.main_window; eh = mw.event_handlers; toolbar = mw.tools_toolbar
+        spacer = QWidget(); spacer.setFixedWidth(40); toolbar.addWidget(spacer)
+        toolbar.addWidget(QLabel("Hardness:"))
+        mw.brush_hardness_slider = QSlider(Qt.Horizontal); mw.brush_hardness_slider.setRange(0, 100)
+        mw.brush_hardness_slider.setValue(100); mw.brush_hardness_slider.setFixedWidth(100)
+        mw.brush_hardness_slider.valueChanged.connect(mw.view.set_brush_hardness) # Connect directly to view
+        toolbar.addWidget(mw.brush_hardness_slider)
+        spacer = QWidget(); spacer.setFixedWidth(10); toolbar.addWidget(spacer)
+        mw.brush_hardness_input = QLineEdit(f"{mw.brush_hardness_slider.value()}"); mw.brush_hardness_input.setFixedWidth(30)
+        mw.brush_hardness_slider.valueChanged.connect(lambda value, inp=mw.brush_hardness_input: inp.setText(str(value)))
+        mw.brush_hardness_input.editingFinished.connect(eh.update_brush_hardness_from_input) # Connect to handler
+        toolbar.addWidget(mw.brush_hardness_input)
+
     def add_pen_style_controls(self):
         mw = self.main_window; eh = mw.event_handlers; toolbar = mw.tools_toolbar
         spacer = QWidget(); spacer.setFixedWidth(10); toolbar.addWidget(spacer)